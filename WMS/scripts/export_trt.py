@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Export WaterMetersUNet weights to ONNX and build a TensorRT engine for serving.
+
+The engine is specialised for the static (1, 3, 512, 512) serving input. Point
+MODEL_PATH at the .plan file and serve/app.py runs it through TensorRT, falling
+back to the .pth with the same name when TensorRT is not available.
+
+Requires the `onnx` package for the export and TensorRT's `trtexec` on PATH for
+the engine build (`--onnx-only` skips the build).
+
+Usage:
+    python WMS/scripts/export_trt.py
+    python WMS/scripts/export_trt.py --weights WMS/models/production.pth --output WMS/models/production.plan
+    python WMS/scripts/export_trt.py --onnx-only
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import torch
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from WMS.src.model import WaterMetersUNet, arch_from_state_dict, fuse_conv_bn
+
+
+def export_onnx(weights_path: str, onnx_path: str, opset: int = 17):
+    """Export the fused eval-mode model with fully static shapes (maximises TRT fusion)."""
+    state_dict = torch.load(weights_path, map_location="cpu")
+    model = WaterMetersUNet(
+        inChannels=3, outChannels=1, **arch_from_state_dict(state_dict)
+    )
+    model.load_state_dict(state_dict)
+    model = fuse_conv_bn(model.eval())
+
+    dummy = torch.zeros(1, 3, 512, 512)
+    torch.onnx.export(
+        model,
+        dummy,
+        onnx_path,
+        input_names=["image"],
+        output_names=["logits"],
+        opset_version=opset,
+        dynamic_axes=None,
+        dynamo=False,
+    )
+    print(f"[OK] Exported ONNX model to: {onnx_path}")
+
+
+def build_engine(onnx_path: str, engine_path: str, fp16: bool = True):
+    """Build a serialized TensorRT engine with trtexec."""
+    trtexec = shutil.which("trtexec")
+    cmd = [
+        trtexec or "trtexec",
+        f"--onnx={onnx_path}",
+        f"--saveEngine={engine_path}",
+        "--builderOptimizationLevel=5",
+    ]
+    if fp16:
+        cmd.append("--fp16")
+
+    if trtexec is None:
+        print("[ERROR] trtexec not found on PATH (it ships with TensorRT)")
+        print(f"        Build the engine on the serving GPU with:\n  {' '.join(cmd)}")
+        sys.exit(1)
+
+    print(f"[*] Building TensorRT engine: {' '.join(cmd)}")
+    subprocess.run(cmd, check=True)
+    print(f"[OK] Saved TensorRT engine to: {engine_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export model to ONNX + TensorRT")
+    parser.add_argument("--weights", default="WMS/models/best.pth")
+    parser.add_argument(
+        "--output", default=None, help="Engine path (default: <weights>.plan)"
+    )
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--no-fp16", action="store_true", help="Build an FP32 engine")
+    parser.add_argument(
+        "--onnx-only", action="store_true", help="Skip the TensorRT build"
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.weights):
+        print(f"[ERROR] Weights not found: {args.weights}")
+        sys.exit(1)
+
+    engine_path = args.output or str(Path(args.weights).with_suffix(".plan"))
+    onnx_path = str(Path(engine_path).with_suffix(".onnx"))
+
+    export_onnx(args.weights, onnx_path, opset=args.opset)
+    if not args.onnx_only:
+        # The engine is tied to the GPU model and TensorRT version it was built with
+        build_engine(onnx_path, engine_path, fp16=not args.no_fp16)
+
+
+if __name__ == "__main__":
+    main()
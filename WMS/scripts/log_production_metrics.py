@@ -82,7 +82,8 @@ def log_production_metrics(mlflow_uri: str, models_dir: str = "WMS/models"):
         print(f"Created: {metrics['created_at']}")
         print(f"\nKey Metrics:")
 
-        for key in ['val_dice', 'val_iou', 'test_dice', 'test_iou']:
+        # final_test_* (best.pth on the test split); test_* only in runs from older train.py
+        for key in ['val_dice', 'val_iou', 'final_test_dice', 'final_test_iou', 'test_dice', 'test_iou']:
             if key in metrics['metrics']:
                 print(f"  {key}: {metrics['metrics'][key]:.4f}")
 
@@ -0,0 +1,195 @@
+"""
+Bake the train/val/test splits into memory-mapped 512x512 uint8 arrays.
+
+Writes data/training/temp/cache/{split}/{images,masks}.npy (outside the
+temp/{train,val,test} DVC outs of the prepare stage) plus files.txt (the sample
+order) and version.txt (the data version it was built from), so
+WMSDataset(cache_dir=...) skips JPEG decode and resize on every epoch.
+For val/test (no augmentation) preprocess=True also writes preprocessed.npy, the
+valTransforms output stored exactly as uint8, so WMSDataset(preprocessed=True) skips
+the contrast stretch and median blur as well.
+Run after prepareDataset.py; train.py calls ensure_cache() itself when data.cache is on.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import cv2
+import numpy as np
+from PIL import Image
+from dataset import WMSDataset
+from transforms import TRAIN_MASK_INTERPOLATION, stretch_and_blur_u8
+
+CACHE_SIZE = 512
+REPO_ROOT = Path(__file__).resolve().parents[2]
+# Bumped when the cached pixels change for the same data version, so old caches rebuild
+CACHE_FORMAT = 2
+
+
+def get_data_version():
+    """Short hash of dvc.lock: the DVC data version (shared with train.py)."""
+    dvc_lock = REPO_ROOT / "dvc.lock"
+    if dvc_lock.exists():
+        return hashlib.md5(dvc_lock.read_bytes()).hexdigest()[:8]
+    return "unknown"
+
+
+def _stamp(version):
+    return f"{version}+cache{CACHE_FORMAT}"
+
+
+def build_cache(
+    imagePaths,
+    maskPaths,
+    cache_dir,
+    size=CACHE_SIZE,
+    version=None,
+    preprocess=False,
+    train=False,
+):
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = os.path.join(cache_dir, "files.txt")
+    for stale in (
+        manifest,
+        os.path.join(cache_dir, "version.txt"),
+        os.path.join(cache_dir, "preprocessed.npy"),
+    ):
+        if os.path.exists(stale):
+            os.remove(stale)  # invalidate while rewriting
+
+    source = WMSDataset(imagePaths, maskPaths, raw=True)
+    n = len(source)
+    images = np.lib.format.open_memmap(
+        os.path.join(cache_dir, "images.npy"),
+        mode="w+",
+        dtype=np.uint8,
+        shape=(n, 3, size, size),
+    )
+    masks = np.lib.format.open_memmap(
+        os.path.join(cache_dir, "masks.npy"),
+        mode="w+",
+        dtype=np.uint8,
+        shape=(n, 1, size, size),
+    )
+    # Train masks are resized like TrainTransforms, val/test ones like WMSDataset
+    mask_interpolation = TRAIN_MASK_INTERPOLATION if train else cv2.INTER_NEAREST
+    preprocessed = None
+    if preprocess:
+        preprocessed = np.lib.format.open_memmap(
+            os.path.join(cache_dir, "preprocessed.npy"),
+            mode="w+",
+            dtype=np.uint8,
+            shape=(n, 3, size, size),
+        )
+    for i in range(n):
+        image, mask = source.load(i)
+        # PIL bilinear (antialiased), same resize as valTransforms
+        image = Image.fromarray(image.permute(1, 2, 0).numpy())
+        image = image.resize((size, size), Image.BILINEAR)
+        image = np.asarray(image)
+        images[i] = image.transpose(2, 0, 1)
+        masks[i, 0] = cv2.resize(mask, (size, size), interpolation=mask_interpolation)
+        if preprocessed is not None:
+            preprocessed[i] = stretch_and_blur_u8(image).transpose(2, 0, 1)
+    images.flush()
+    masks.flush()
+    if preprocessed is not None:
+        preprocessed.flush()
+    del images, masks, preprocessed
+
+    if version is not None:
+        with open(os.path.join(cache_dir, "version.txt"), "w") as f:
+            f.write(_stamp(version))
+    # Written last: marks the cache as complete
+    with open(manifest, "w") as f:
+        f.write("\n".join(os.path.basename(p) for p in imagePaths))
+    print(f"  → Cached {n} samples to {cache_dir}")
+    return cache_dir
+
+
+def _cached_version(cache_dir):
+    path = os.path.join(cache_dir, "version.txt")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip()
+
+
+def ensure_cache(
+    imagePaths, maskPaths, cache_dir, version=None, preprocess=False, train=False
+):
+    """
+    Build the cache only if it is missing, was built for a different file list or,
+    when `version` is given, from a different data version (same file names, new pixels)
+    or CACHE_FORMAT, or (with preprocess) lacks preprocessed.npy. An "unknown" version
+    (no dvc.lock) never matches, since the pixels can't be vouched for.
+    """
+    manifest = os.path.join(cache_dir, "files.txt")
+    if (
+        os.path.exists(manifest)
+        and (
+            version is None
+            or (version != "unknown" and _cached_version(cache_dir) == _stamp(version))
+        )
+        and (
+            not preprocess
+            or os.path.exists(os.path.join(cache_dir, "preprocessed.npy"))
+        )
+    ):
+        with open(manifest) as f:
+            if f.read().splitlines() == [os.path.basename(p) for p in imagePaths]:
+                return cache_dir
+    return build_cache(
+        imagePaths,
+        maskPaths,
+        cache_dir,
+        version=version,
+        preprocess=preprocess,
+        train=train,
+    )
+
+
+if __name__ == "__main__":
+    baseDataDir = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "data", "training", "temp"
+    )
+    # Same order as train.py: the split manifest from prepareDataset.py, else sorted listings
+    splits_manifest = os.path.join(baseDataDir, "splits.json")
+    splitPaths = {}
+    if os.path.exists(splits_manifest):
+        with open(splits_manifest) as f:
+            splitPaths = json.load(f)
+    # Stamped like train.py's ensure_cache, so the next training run reuses this cache
+    version = get_data_version()
+    for split in ("train", "val", "test"):
+        if split in splitPaths:
+            build_cache(
+                splitPaths[split]["images"],
+                splitPaths[split]["masks"],
+                os.path.join(baseDataDir, "cache", split),
+                version=version,
+                preprocess=split != "train",
+                train=split == "train",
+            )
+            continue
+        img_dir = os.path.join(baseDataDir, split, "images")
+        mask_dir = os.path.join(baseDataDir, split, "masks")
+        images = sorted(
+            os.path.join(img_dir, f)
+            for f in os.listdir(img_dir)
+            if f.endswith((".jpg", ".png"))
+        )
+        masks = sorted(
+            os.path.join(mask_dir, f)
+            for f in os.listdir(mask_dir)
+            if f.endswith((".jpg", ".png"))
+        )
+        build_cache(
+            images,
+            masks,
+            os.path.join(baseDataDir, "cache", split),
+            version=version,
+            preprocess=split != "train",
+            train=split == "train",
+        )
@@ -1,14 +1,29 @@
 from torch.utils.data import (
     Dataset,
 )  # All PyTorch datasets must inherit from this base dataset class
+import io
+import os
 import cv2
 import torch
 import numpy as np
+from PIL import Image
+from torchvision.io import ImageReadMode, decode_image, decode_jpeg, read_file
+
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+EXIF_ORIENTATION = 0x0112
 
 
 class WMSDataset(Dataset):
     def __init__(
-        self, imagePaths, maskPaths, imageTransforms=None, paired_transforms=None
+        self,
+        imagePaths,
+        maskPaths,
+        imageTransforms=None,
+        paired_transforms=None,
+        raw=False,
+        cache_dir=None,
+        encoded=False,
+        preprocessed=False,
     ):
         """
         Args:
@@ -16,23 +31,90 @@ class WMSDataset(Dataset):
             maskPaths: List of mask paths
             imageTransforms: Legacy transforms (applied only to image) - for backward compatibility
             paired_transforms: New transforms that take (image, mask) and return (image_tensor, mask_tensor)
+            raw: Return the decoded uint8 CHW image and 1xHxW 0/1 mask at their original size,
+                 without any transforms (use with raw_collate + transforms.GPUPreprocessor)
+            cache_dir: Directory written by build_cache.py; samples are then read pre-resized
+                 (512x512 uint8) from its memory-mapped images.npy / masks.npy instead of decoded
+            encoded: With raw=True (and no cache), return JPEG images undecoded as their 1-D
+                 uint8 file bytes, to be decoded with nvJPEG on the GPU (see GPUDecodeLoader)
+            preprocessed: With cache_dir (built with preprocess=True), return the cached
+                 valTransforms output (float32 3x512x512) instead of applying imageTransforms;
+                 only for splits without augmentation (val/test)
         """
         self.imagePaths = imagePaths
         self.maskPaths = maskPaths
         self.imageTransforms = imageTransforms
         self.paired_transforms = paired_transforms
+        self.raw = raw
+        self.cache_dir = cache_dir
+        self.encoded = encoded and raw and cache_dir is None
+        self.preprocessed = preprocessed and cache_dir is not None and not raw
+        self.cached_images = self.cached_masks = None
+        if cache_dir is not None:
+            with open(os.path.join(cache_dir, "files.txt")) as f:
+                cached_files = f.read().splitlines()
+            if cached_files != [os.path.basename(p) for p in imagePaths]:
+                raise ValueError(
+                    f"Cache {cache_dir} does not match the image list, rebuild it with build_cache.py"
+                )
+
+    def _open_cache(self):
+        # Opened lazily so each DataLoader worker maps the files itself (nothing large is pickled);
+        # pages are read on demand and shared through the OS page cache
+        images_file = "preprocessed.npy" if self.preprocessed else "images.npy"
+        self.cached_images = np.load(
+            os.path.join(self.cache_dir, images_file), mmap_mode="r"
+        )
+        self.cached_masks = np.load(
+            os.path.join(self.cache_dir, "masks.npy"), mmap_mode="r"
+        )
 
     def __len__(self):
         return len(self.imagePaths)
 
-    def __getitem__(self, i):
+    def load(self, i):
+        """Return the uint8 CHW image tensor and uint8 HxW 0/1 mask array for sample i."""
+        if self.cache_dir is not None:
+            if self.cached_images is None:
+                self._open_cache()
+            # Already resized to 512x512 by build_cache.py: no decode, no resize
+            image = torch.from_numpy(self.cached_images[i].copy())
+            return image, self.cached_masks[i, 0].copy()
+
         image_path = self.imagePaths[i]  # Grab the image path form the current index
-        image = cv2.imread(image_path)  # Load image
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        # libjpeg-turbo / libpng decode straight to RGB (no BGR->RGB swizzle); the EXIF
+        # orientation is applied like cv2.imread did, so rotated photos line up with their masks
+        image = decode_image(
+            read_file(image_path), mode=ImageReadMode.RGB, apply_exif_orientation=True
+        )
 
         mask = cv2.imread(self.maskPaths[i], cv2.IMREAD_GRAYSCALE)  # uint8
         # Threshold to 0/1
         mask = (mask >= 127).astype(np.uint8)
+        return image, mask
+
+    def __getitem__(self, i):
+        if self.encoded and self.imagePaths[i].lower().endswith(JPEG_EXTENSIONS):
+            mask = cv2.imread(self.maskPaths[i], cv2.IMREAD_GRAYSCALE)
+            mask = (mask >= 127).astype(np.uint8)
+            return read_file(self.imagePaths[i]), torch.from_numpy(mask)[None, ...]
+
+        if self.preprocessed:
+            if self.cached_images is None:
+                self._open_cache()
+            # Stored as k/255 levels: the same float32 values valTransforms returns
+            image = self.cached_images[i].astype(np.float32)
+            image /= 255.0
+            mask = self.cached_masks[i].astype(np.float32)  # 1xHxW
+            return torch.from_numpy(image), torch.from_numpy(mask)
+
+        image, mask = self.load(i)
+
+        # Raw mode: resize/normalize happen later on the GPU
+        if self.raw:
+            return image, torch.from_numpy(mask)[None, ...]
+
+        image = image.permute(1, 2, 0).numpy()  # CHW uint8 -> HWC view, no copy
 
         # Use new paired transforms if available (for training with augmentation)
         if self.paired_transforms:
@@ -49,3 +131,111 @@ class WMSDataset(Dataset):
         mask = torch.from_numpy(mask.astype(np.float32))[None, ...]  # 1xHxW
 
         return image, mask
+
+
+def raw_collate(batch):
+    """Collate raw (variable-size) samples into lists instead of stacked tensors."""
+    images, masks = zip(*batch)
+    return list(images), list(masks)
+
+
+def exif_orientation(data):
+    """Return the EXIF orientation tag (1-8, 1 if absent) of encoded image bytes (1-D uint8 tensor)."""
+    with Image.open(io.BytesIO(data.numpy().tobytes())) as image:
+        return image.getexif().get(EXIF_ORIENTATION, 1)
+
+
+def apply_exif_orientation(image, orientation):
+    """Rotate/flip a CHW image tensor (on any device) upright for the given EXIF orientation."""
+    if orientation in (5, 6, 7, 8):
+        image = image.transpose(-2, -1)
+    if orientation in (2, 3, 6, 7):
+        image = image.flip(-1)
+    if orientation in (3, 4, 7, 8):
+        image = image.flip(-2)
+    return image
+
+
+def _to_device(x, device, non_blocking=False):
+    if isinstance(x, (list, tuple)):
+        return [t.to(device, non_blocking=non_blocking) for t in x]
+    return x.to(device, non_blocking=non_blocking)
+
+
+class GPUDecodeLoader:
+    """
+    Wraps a raw_collate DataLoader over WMSDataset(raw=True, encoded=True) and decodes
+    the encoded JPEG entries of each batch with nvJPEG (one batched decode_jpeg call)
+    straight into `device` memory; already decoded images pass through unchanged.
+    nvJPEG ignores EXIF, so the orientation is read on the CPU and applied afterwards,
+    matching the CPU decode in WMSDataset.load.
+    Meant to sit inside DataPrefetcher, which then only has to copy the masks.
+    """
+
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = device
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for images, masks in self.loader:
+            encoded = [i for i, image in enumerate(images) if image.ndim == 1]
+            if encoded:
+                decoded = decode_jpeg(
+                    [images[i] for i in encoded],
+                    mode=ImageReadMode.RGB,
+                    device=self.device,
+                )
+                for i, image in zip(encoded, decoded):
+                    images[i] = apply_exif_orientation(
+                        image, exif_orientation(images[i])
+                    )
+            yield images, masks
+
+
+class DataPrefetcher:
+    """
+    Wraps a DataLoader and copies the next (image, mask) batch to the GPU on a side
+    CUDA stream while the current batch is being processed.
+
+    The wrapped DataLoader should use pin_memory=True (otherwise the copy cannot run
+    asynchronously) and num_workers around min(n_cores, batch_size). On CPU it simply
+    yields the batches moved to `device`. Batches from raw_collate (lists of
+    tensors) are moved element-wise.
+    """
+
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = device
+        self.stream = torch.cuda.Stream() if device.type == "cuda" else None
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _preload(self, batches):
+        try:
+            images, masks = next(batches)
+        except StopIteration:
+            return None
+        if self.stream is None:
+            return _to_device(images, self.device), _to_device(masks, self.device)
+        with torch.cuda.stream(self.stream):
+            images = _to_device(images, self.device, non_blocking=True)
+            masks = _to_device(masks, self.device, non_blocking=True)
+        return images, masks
+
+    def __iter__(self):
+        batches = iter(self.loader)
+        next_batch = self._preload(batches)
+        while next_batch is not None:
+            if self.stream is not None:
+                # Make the compute stream wait for the copy, and keep the memory alive
+                torch.cuda.current_stream().wait_stream(self.stream)
+                for x in next_batch:
+                    for t in x if isinstance(x, list) else [x]:
+                        t.record_stream(torch.cuda.current_stream())
+            batch = next_batch
+            next_batch = self._preload(batches)
+            yield batch
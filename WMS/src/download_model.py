@@ -8,11 +8,39 @@ Usage:
 """
 
 import argparse
+import glob
 import os
 import sys
+import tempfile
 import torch
 import mlflow
 import mlflow.pytorch
+from mlflow.tracking import MlflowClient
+
+
+def resolve_model_version(client: MlflowClient, model_name: str, version: str):
+    """Return the registry ModelVersion for a version number or a stage name."""
+    if version.isdigit():
+        return client.get_model_version(model_name, version)
+    versions = client.get_latest_versions(model_name, stages=[version.capitalize()])
+    if not versions:
+        raise RuntimeError(f"No '{version}' version of model '{model_name}'")
+    return versions[0]
+
+
+def fetch_state_dict(model_uri: str) -> dict:
+    """Download the logged model files and return its state_dict."""
+    with tempfile.TemporaryDirectory() as tmp:
+        local = mlflow.artifacts.download_artifacts(
+            artifact_uri=model_uri, dst_path=tmp
+        )
+        weights = glob.glob(os.path.join(local, "**", "*.pth"), recursive=True)
+        if weights:
+            # mlflow.pytorch pickles the whole module; only its weights are kept
+            obj = torch.load(weights[0], map_location="cpu", weights_only=False)
+            return obj.state_dict() if isinstance(obj, torch.nn.Module) else obj
+    # Other serialization formats: let the flavor load it
+    return mlflow.pytorch.load_model(model_uri, map_location="cpu").state_dict()
 
 
 def download_production_model(
@@ -23,37 +51,52 @@ def download_production_model(
     force: bool = False,
 ):
     """Download Production model from MLflow registry."""
+    rev_path = output_path + ".rev"  # run_id of the cached weights
 
-    # Check if already cached
-    if os.path.exists(output_path) and not force:
-        print(f"[OK] Production model already cached: {output_path}")
-        print(f"     To re-download, use --force flag")
-        return output_path
-
-    print(f"[*] Downloading Production model from MLflow...")
+    print(f"[*] Checking Production model in MLflow...")
     print(f"    MLflow URI: {mlflow_uri}")
     print(f"    Model: {model_name}/{version}")
 
     try:
         # Connect to MLflow
         mlflow.set_tracking_uri(mlflow_uri)
-
-        # Load model from registry
-        model_uri = f"models:/{model_name}/{version}"
-        print(f"   Loading: {model_uri}")
-        model = mlflow.pytorch.load_model(model_uri, map_location="cpu")
+        client = MlflowClient(tracking_uri=mlflow_uri)
+        model_version = resolve_model_version(client, model_name, version)
+
+        # Skip the download if the cached file is from the same run
+        if os.path.exists(output_path) and os.path.exists(rev_path) and not force:
+            with open(rev_path) as f:
+                if f.read().strip() == model_version.run_id:
+                    print(f"[OK] Production model already cached: {output_path}")
+                    print(
+                        f"     (version {model_version.version}, run {model_version.run_id})"
+                    )
+                    print(f"     To re-download, use --force flag")
+                    return output_path
+
+        # Fetch artifacts directly (no model instantiation through the flavor)
+        model_uri = f"models:/{model_name}/{model_version.version}"
+        print(f"   Downloading: {model_uri} (run {model_version.run_id})")
+        state_dict = fetch_state_dict(model_uri)
 
         # Create output directory
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
 
         # Save state dict
-        torch.save(model.state_dict(), output_path)
+        torch.save(state_dict, output_path)
+        with open(rev_path, "w") as f:
+            f.write(model_version.run_id)
 
         print(f"[OK] Downloaded Production model to: {output_path}")
         print(f"     You can now use it offline for predictions!")
         return output_path
 
     except Exception as e:
+        if os.path.exists(output_path) and not force:
+            # Offline: keep using the cached weights
+            print(f"[WARN] Could not check MLflow ({e})")
+            print(f"[OK] Using cached model: {output_path}")
+            return output_path
         print(f"[ERROR] Failed to download model from MLflow: {e}")
         print(f"\nTroubleshooting:")
         print(
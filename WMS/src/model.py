@@ -1,11 +1,51 @@
 import torch
 import torch.nn as nn  # Conv2d, BatchNorm2d etc.
 import torch.nn.functional as F  # interpolate
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+
+class DSConv2d(nn.Module):
+    """
+    Depthwise-separable drop-in for nn.Conv2d(in, out, 3, padding=1): a per-channel
+    3x3 conv followed by a 1x1 pointwise conv (~9x fewer FLOPs for wide layers).
+    """
+
+    def __init__(self, in_ch, out_ch, kernel_size=3, padding=1):
+        super(DSConv2d, self).__init__()
+        self.depthwise = nn.Conv2d(
+            in_ch, in_ch, kernel_size, padding=padding, groups=in_ch, bias=False
+        )
+        self.pointwise = nn.Conv2d(in_ch, out_ch, kernel_size=1)
+
+    def forward(self, x):
+        return self.pointwise(self.depthwise(x))
+
+
+def _pixel_shuffle_up(in_ch, out_ch):
+    return nn.Sequential(
+        nn.Conv2d(in_ch, out_ch * 4, kernel_size=1), nn.PixelShuffle(2)
+    )
 
 
 class WaterMetersUNet(nn.Module):
-    def __init__(self, inChannels, baseFilters=16, outChannels=1):
+    def __init__(
+        self,
+        inChannels,
+        baseFilters=16,
+        outChannels=1,
+        separable=False,
+        pixel_shuffle=False,
+    ):
+        """
+        Args:
+            separable: Use DSConv2d for every 3x3 conv except the first one of enc1
+                (RGB input). Not weight-compatible with the default dense model.
+            pixel_shuffle: Upsample with a 1x1 conv + nn.PixelShuffle(2) to the skip's
+                channel count instead of bilinear interpolation (input H, W must be
+                divisible by 16). Not weight-compatible with the default model.
+        """
         super(WaterMetersUNet, self).__init__()
+        conv = DSConv2d if separable else nn.Conv2d
 
         # ======================================= ENCODER =============================================
         # Double convolution blocks for better feature extraction
@@ -15,21 +55,17 @@ class WaterMetersUNet(nn.Module):
             ),  # inChannels -> baseChannels (3 -> 16)
             nn.BatchNorm2d(baseFilters),
             nn.ReLU(inplace=True),
-            nn.Conv2d(
-                baseFilters, baseFilters, kernel_size=3, padding=1
-            ),  # Double conv
+            conv(baseFilters, baseFilters, kernel_size=3, padding=1),  # Double conv
             nn.BatchNorm2d(baseFilters),
             nn.ReLU(inplace=True),
         )
         self.pool1 = nn.MaxPool2d(2, stride=2)  # Resize h, w by half (e.g. 512 -> 256)
 
         self.enc2 = nn.Sequential(
-            nn.Conv2d(
-                baseFilters, baseFilters * 2, kernel_size=3, padding=1
-            ),  # (16 -> 32)
+            conv(baseFilters, baseFilters * 2, kernel_size=3, padding=1),  # (16 -> 32)
             nn.BatchNorm2d(baseFilters * 2),
             nn.ReLU(inplace=True),
-            nn.Conv2d(
+            conv(
                 baseFilters * 2, baseFilters * 2, kernel_size=3, padding=1
             ),  # Double conv
             nn.BatchNorm2d(baseFilters * 2),
@@ -38,12 +74,12 @@ class WaterMetersUNet(nn.Module):
         self.pool2 = nn.MaxPool2d(2, stride=2)
 
         self.enc3 = nn.Sequential(
-            nn.Conv2d(
+            conv(
                 baseFilters * 2, baseFilters * 4, kernel_size=3, padding=1
             ),  # (32 -> 64)
             nn.BatchNorm2d(baseFilters * 4),
             nn.ReLU(inplace=True),
-            nn.Conv2d(
+            conv(
                 baseFilters * 4, baseFilters * 4, kernel_size=3, padding=1
             ),  # Double conv
             nn.BatchNorm2d(baseFilters * 4),
@@ -52,12 +88,12 @@ class WaterMetersUNet(nn.Module):
         self.pool3 = nn.MaxPool2d(2, stride=2)
 
         self.enc4 = nn.Sequential(
-            nn.Conv2d(
+            conv(
                 baseFilters * 4, baseFilters * 8, kernel_size=3, padding=1
             ),  # (64 -> 128)
             nn.BatchNorm2d(baseFilters * 8),
             nn.ReLU(inplace=True),
-            nn.Conv2d(
+            conv(
                 baseFilters * 8, baseFilters * 8, kernel_size=3, padding=1
             ),  # Double conv
             nn.BatchNorm2d(baseFilters * 8),
@@ -67,12 +103,12 @@ class WaterMetersUNet(nn.Module):
 
         # Deepest layer of UNet, without pooling after that
         self.bottleneck = nn.Sequential(
-            nn.Conv2d(
+            conv(
                 baseFilters * 8, baseFilters * 16, kernel_size=3, padding=1
             ),  # (128 -> 256)
             nn.BatchNorm2d(baseFilters * 16),
             nn.ReLU(inplace=True),
-            nn.Conv2d(
+            conv(
                 baseFilters * 16, baseFilters * 16, kernel_size=3, padding=1
             ),  # Double conv
             nn.BatchNorm2d(baseFilters * 16),
@@ -80,16 +116,26 @@ class WaterMetersUNet(nn.Module):
         )
 
         # ==================== DECODER (Rebuilding resolution (upsampling)) ======================
+        # Optional channel-to-space upsampling: 1x1 conv to 4*C_skip, then PixelShuffle(2) -> C_skip
+        self.up4 = self.up3 = self.up2 = self.up1 = None
+        if pixel_shuffle:
+            self.up4 = _pixel_shuffle_up(baseFilters * 16, baseFilters * 8)
+            self.up3 = _pixel_shuffle_up(baseFilters * 8, baseFilters * 4)
+            self.up2 = _pixel_shuffle_up(baseFilters * 4, baseFilters * 2)
+            self.up1 = _pixel_shuffle_up(baseFilters * 2, baseFilters)
+        # Upsampled channels = up_ch * skip channels (bilinear keeps the deeper, 2x wider tensor)
+        up_ch = 1 if pixel_shuffle else 2
+
         self.dec4 = nn.Sequential(  # bottleneck + enc4 -> (256 + 128 = 384 [channels])
-            nn.Conv2d(
-                baseFilters * 16 + baseFilters * 8,
+            conv(
+                baseFilters * 8 * up_ch + baseFilters * 8,
                 baseFilters * 8,
                 kernel_size=3,
                 padding=1,
             ),  # 384 -> 128
             nn.BatchNorm2d(baseFilters * 8),
             nn.ReLU(inplace=True),
-            nn.Conv2d(
+            conv(
                 baseFilters * 8, baseFilters * 8, kernel_size=3, padding=1
             ),  # Double conv
             nn.BatchNorm2d(baseFilters * 8),
@@ -97,15 +143,15 @@ class WaterMetersUNet(nn.Module):
         )
 
         self.dec3 = nn.Sequential(  # dec4 + enc3 -> (128 + 64 = 192 [channels])
-            nn.Conv2d(
-                baseFilters * 8 + baseFilters * 4,
+            conv(
+                baseFilters * 4 * up_ch + baseFilters * 4,
                 baseFilters * 4,
                 kernel_size=3,
                 padding=1,
             ),  # 192 -> 64
             nn.BatchNorm2d(baseFilters * 4),
             nn.ReLU(inplace=True),
-            nn.Conv2d(
+            conv(
                 baseFilters * 4, baseFilters * 4, kernel_size=3, padding=1
             ),  # Double conv
             nn.BatchNorm2d(baseFilters * 4),
@@ -113,15 +159,15 @@ class WaterMetersUNet(nn.Module):
         )
 
         self.dec2 = nn.Sequential(  # dec3 + enc2 -> (64 + 32 = 96 [channels])
-            nn.Conv2d(
-                baseFilters * 4 + baseFilters * 2,
+            conv(
+                baseFilters * 2 * up_ch + baseFilters * 2,
                 baseFilters * 2,
                 kernel_size=3,
                 padding=1,
             ),  # 96 -> 32
             nn.BatchNorm2d(baseFilters * 2),
             nn.ReLU(inplace=True),
-            nn.Conv2d(
+            conv(
                 baseFilters * 2, baseFilters * 2, kernel_size=3, padding=1
             ),  # Double conv
             nn.BatchNorm2d(baseFilters * 2),
@@ -129,14 +175,12 @@ class WaterMetersUNet(nn.Module):
         )
 
         self.dec1 = nn.Sequential(  # dec2 + enc1 -> (32 + 16 = 48 [channels])
-            nn.Conv2d(
-                baseFilters * 2 + baseFilters, baseFilters, kernel_size=3, padding=1
+            conv(
+                baseFilters * up_ch + baseFilters, baseFilters, kernel_size=3, padding=1
             ),  # 48 -> 16
             nn.BatchNorm2d(baseFilters),
             nn.ReLU(inplace=True),
-            nn.Conv2d(
-                baseFilters, baseFilters, kernel_size=3, padding=1
-            ),  # Double conv
+            conv(baseFilters, baseFilters, kernel_size=3, padding=1),  # Double conv
             nn.BatchNorm2d(baseFilters),
             nn.ReLU(inplace=True),
         )
@@ -144,6 +188,17 @@ class WaterMetersUNet(nn.Module):
         # Last layer 1x1 16 -> outChannels (1)
         self.final = nn.Conv2d(baseFilters, outChannels, kernel_size=1)
 
+    @staticmethod
+    def _upsample(up, x, skip):
+        """Upsample x to the skip's resolution and concatenate the skip connection."""
+        if up is None:
+            x = F.interpolate(
+                x, size=skip.shape[2:], mode="bilinear", align_corners=False
+            )
+        else:
+            x = up(x)
+        return torch.cat((x, skip), dim=1)
+
     def forward(self, x):
         e1 = self.enc1(x)  # (N, baseFilters, H, W)
         p1 = self.pool1(e1)  # (N, baseFilters, H/2, W/2)
@@ -159,21 +214,48 @@ class WaterMetersUNet(nn.Module):
 
         b = self.bottleneck(p4)  # (N, baseFilters*16, H/16, W/16)
 
-        d4 = F.interpolate(b, size=e4.shape[2:], mode="bilinear", align_corners=False)
-        d4 = torch.cat((d4, e4), dim=1)
+        d4 = self._upsample(self.up4, b, e4)
         d4 = self.dec4(d4)  # (N, baseFilters*8, H/8, W/8)
 
-        d3 = F.interpolate(d4, size=e3.shape[2:], mode="bilinear", align_corners=False)
-        d3 = torch.cat((d3, e3), dim=1)
+        d3 = self._upsample(self.up3, d4, e3)
         d3 = self.dec3(d3)  # (N, baseFilters*4, H/4, W/4)
 
-        d2 = F.interpolate(d3, size=e2.shape[2:], mode="bilinear", align_corners=False)
-        d2 = torch.cat((d2, e2), dim=1)
+        d2 = self._upsample(self.up2, d3, e2)
         d2 = self.dec2(d2)  # (N, baseFilters*2, H/2, W/2)
 
-        d1 = F.interpolate(d2, size=e1.shape[2:], mode="bilinear", align_corners=False)
-        d1 = torch.cat((d1, e1), dim=1)
+        d1 = self._upsample(self.up1, d2, e1)
         d1 = self.dec1(d1)  # (N, baseFilters, H, W)
 
         out = self.final(d1)  # (N, out_channels, H, W)
         return out
+
+
+def arch_from_state_dict(state_dict):
+    """WaterMetersUNet kwargs matching the layout of a saved state_dict."""
+    return {
+        "separable": any(".depthwise." in k for k in state_dict),
+        "pixel_shuffle": any(k.startswith("up4.") for k in state_dict),
+    }
+
+
+def fuse_conv_bn(model):
+    """
+    Fold every eval-mode BatchNorm2d into the Conv2d that precedes it.
+
+    Inference only: the BN is replaced by nn.Identity, so the returned model can
+    no longer be trained or loaded from a regular (unfused) state_dict.
+    """
+    for block in list(model.modules()):
+        if not isinstance(block, nn.Sequential):
+            continue
+        for i in range(len(block) - 1):
+            conv, bn = block[i], block[i + 1]
+            if not isinstance(bn, nn.BatchNorm2d):
+                continue
+            if isinstance(conv, nn.Conv2d):
+                block[i] = fuse_conv_bn_eval(conv, bn)
+                block[i + 1] = nn.Identity()
+            elif isinstance(conv, DSConv2d):  # BN follows the pointwise conv
+                conv.pointwise = fuse_conv_bn_eval(conv.pointwise, bn)
+                block[i + 1] = nn.Identity()
+    return model
@@ -1,10 +1,28 @@
 import torch
-import matplotlib.pyplot as plt
-from model import WaterMetersUNet
+import numpy as np
+from model import WaterMetersUNet, arch_from_state_dict, fuse_conv_bn
 from transforms import valTransforms
 import cv2
 import os
 import sys
+import argparse
+
+parser = argparse.ArgumentParser(description="Predict masks for custom photos")
+parser.add_argument(
+    "--batch-size", type=int, default=8, help="Images per forward pass (default: 8)"
+)
+parser.add_argument(
+    "--show", action="store_true", help="Display each prediction with matplotlib"
+)
+parser.add_argument(
+    "--overview",
+    action="store_true",
+    help="Also save a side-by-side original|mask PNG for each photo",
+)
+args = parser.parse_args()
+
+if args.show:
+    import matplotlib.pyplot as plt
 
 # Preparing paths for custom predictions
 baseDataDir = os.path.join(os.path.dirname(__file__), "..", "data")
@@ -16,7 +34,6 @@ os.makedirs(save_dir, exist_ok=True)
 
 # Loading model and weight
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = WaterMetersUNet(inChannels=3, outChannels=1).to(device)
 
 # Try production.pth (downloaded from MLflow), fallback to best.pth
 model_candidates = [
@@ -41,38 +58,86 @@ if modelPath is None:
     print("  python WMS/src/train.py")
     sys.exit(1)
 
-checkpoint = torch.load(modelPath, map_location=device)
-model.load_state_dict(checkpoint)
+# mmap + weights_only: page in the plain state_dict without the generic unpickler
+checkpoint = torch.load(modelPath, map_location=device, mmap=True, weights_only=True)
+model = WaterMetersUNet(inChannels=3, outChannels=1, **arch_from_state_dict(checkpoint))
+model.load_state_dict(checkpoint, assign=True)  # adopt the on-device tensors, no copy
 model.eval()
+# Inference-only script; inference_mode below is the main guard
+torch.set_grad_enabled(False)
+model = fuse_conv_bn(model)  # fold BN into the preceding conv (eval only)
+# NHWC layout lets cuDNN dispatch Tensor-Core friendly kernels for the 3x3 convs
+model = model.to(memory_format=torch.channels_last)
+torch.backends.cudnn.benchmark = True  # fixed 512x512 input, autotune once
+# BF16 Tensor Cores need Ampere+ (sm_80); older GPUs (e.g. T4) get FP16 ones
+amp_dtype = torch.bfloat16
+if device.type == "cuda" and torch.cuda.get_device_capability(device)[0] < 8:
+    amp_dtype = torch.float16
+
+# Compile for the fixed (B, 3, 512, 512) input; CUDA graphs need a GPU
+if device.type == "cuda" and hasattr(torch, "compile"):
+    model = torch.compile(model, mode="reduce-overhead", dynamic=False)
+    # Warm up so compilation and CUDA graph capture happen before the loop
+    dummy = torch.zeros(args.batch_size, 3, 512, 512, device=device).to(
+        memory_format=torch.channels_last
+    )
+    with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=amp_dtype):
+        model(dummy)
+
+fnames = sorted(
+    f for f in os.listdir(custom_dir) if f.lower().endswith((".jpg", ".png"))
+)
 
-for fname in os.listdir(custom_dir):
-    if not fname.lower().endswith((".jpg", ".png")):
-        continue
-    img_path = os.path.join(custom_dir, fname)
+for start in range(0, len(fnames), args.batch_size):
+    end = start + args.batch_size
+    batch_fnames = fnames[start:end]
     # 1) Load and convert to RGB
-    bgr = cv2.imread(img_path)
-    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
-    orig_resized = cv2.resize(rgb, (512, 512), interpolation=cv2.INTER_AREA)
+    rgbs = [
+        cv2.cvtColor(cv2.imread(os.path.join(custom_dir, f)), cv2.COLOR_BGR2RGB)
+        for f in batch_fnames
+    ]
     # 2) Apply same transformations as in training
-    tensor = valTransforms(rgb).unsqueeze(0).to(device)  # [1,3,512,512]
-    # 3) Prediction
-    with torch.no_grad():
-        out = model(tensor)
-        prob = torch.sigmoid(out).squeeze().cpu().numpy()  # [512,512]
+    batch = torch.stack([valTransforms(rgb) for rgb in rgbs]).to(
+        device, memory_format=torch.channels_last, non_blocking=True
+    )  # [B,3,512,512]
+    # 3) Prediction - one forward pass for the whole batch
+    # BF16/FP16 autocast on CUDA (Tensor Cores); plain FP32 on CPU
+    with torch.inference_mode(), torch.autocast(
+        device_type=device.type, dtype=amp_dtype, enabled=device.type == "cuda"
+    ):
+        out = model(batch)
+    out = out.float()  # keep sigmoid + threshold in FP32
+    probs = torch.sigmoid(out).squeeze(1).cpu().numpy()  # [B,512,512]
+
+    for fname, rgb, prob in zip(batch_fnames, rgbs, probs):
         predM = (prob > 0.5).astype("uint8") * 255  # 0/255
 
-    # 4) Display both images
-    fig, ax = plt.subplots(1, 2, figsize=(10, 5))
-    ax[0].imshow(orig_resized)
-    ax[0].set_title("Original")
-    ax[0].axis("off")
-    ax[1].imshow(predM, cmap="gray")
-    ax[1].set_title("Predicted mask")
-    ax[1].axis("off")
-    plt.suptitle(fname)
-    plt.show()
-
-    # 5) Save the predicted mask
-    cv2.imwrite(os.path.join(save_dir, f"mask_{fname}"), predM)
+        # 4) Display both images (opt-in, blocks on the GUI)
+        if args.show:
+            orig_resized = cv2.resize(rgb, (512, 512), interpolation=cv2.INTER_AREA)
+            fig, ax = plt.subplots(1, 2, figsize=(10, 5))
+            ax[0].imshow(orig_resized)
+            ax[0].set_title("Original")
+            ax[0].axis("off")
+            ax[1].imshow(predM, cmap="gray")
+            ax[1].set_title("Predicted mask")
+            ax[1].axis("off")
+            plt.suptitle(fname)
+            plt.show()
+            plt.close(fig)
+
+        # 5) Save the predicted mask
+        cv2.imwrite(os.path.join(save_dir, f"mask_{fname}"), predM)
+
+        # 6) Optional side-by-side overview (one cv2.imwrite, no matplotlib)
+        if args.overview:
+            orig_bgr = cv2.resize(
+                cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR),
+                (512, 512),
+                interpolation=cv2.INTER_AREA,
+            )
+            overview = np.hstack([orig_bgr, cv2.cvtColor(predM, cv2.COLOR_GRAY2BGR)])
+            stem = os.path.splitext(fname)[0]
+            cv2.imwrite(os.path.join(save_dir, f"overview_{stem}.png"), overview)
 
 print(f"Predictions complete! Masks saved to: {save_dir}")
@@ -1,7 +1,9 @@
 import os
+import json
 import shutil
 import random
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 from sklearn.model_selection import train_test_split
@@ -24,13 +26,18 @@ datasetPath = os.path.dirname(os.path.abspath(__file__))
 sourceImageDir = os.path.join(datasetPath, "..", "data", "training", "images")
 sourceMaskDir = os.path.join(datasetPath, "..", "data", "training", "masks")
 
+
+def list_images(directory):
+    # scandir yields dirents with their type cached, so no extra stat per entry
+    with os.scandir(directory) as entries:
+        return sorted(
+            e.name for e in entries if e.is_file() and e.name.endswith((".jpg", ".png"))
+        )
+
+
 # Get images and masks names
-imageFiles = sorted(
-    [f for f in os.listdir(sourceImageDir) if f.endswith((".jpg", ".png"))]
-)
-maskFiles = sorted(
-    [f for f in os.listdir(sourceMaskDir) if f.endswith((".jpg", ".png"))]
-)
+imageFiles = list_images(sourceImageDir)
+maskFiles = list_images(sourceMaskDir)
 
 # Create mapping from stem to full filename for masks (images and masks may have different extensions)
 from pathlib import Path
@@ -51,21 +58,32 @@ valImgs, testImgs = train_test_split(tempImgs, test_size=0.5, random_state=_seed
 
 splits = {"train": trainImgs, "val": valImgs, "test": testImgs}
 
+
+def link_or_copy(src, dst):
+    # Hard link: no data copied, same inode. Falls back to a copy across devices
+    if os.path.lexists(dst):
+        os.remove(dst)  # stale file/link from a previous run
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+
 # Folders creation
 baseDataDir = os.path.join(datasetPath, "..", "data", "training", "temp")
 for split, files in splits.items():
     for subfolder in ["images", "masks"]:
         os.makedirs(os.path.join(baseDataDir, split, subfolder), exist_ok=True)
     for img_fname in files:
-        # Copy image
-        shutil.copy(
+        # Link image
+        link_or_copy(
             os.path.join(sourceImageDir, img_fname),
             os.path.join(baseDataDir, split, "images", img_fname),
         )
-        # Find and copy corresponding mask (may have different extension)
+        # Find and link corresponding mask (may have different extension)
         img_stem = Path(img_fname).stem
         mask_fname = mask_map[img_stem]
-        shutil.copy(
+        link_or_copy(
             os.path.join(sourceMaskDir, mask_fname),
             os.path.join(baseDataDir, split, "masks", mask_fname),
         )
@@ -75,39 +93,28 @@ os.makedirs("../models", exist_ok=True)
 results_dir = os.path.join(datasetPath, "..", "Results")
 os.makedirs(results_dir, exist_ok=True)
 
-# Load data from folder 'train'
-trainImagePaths = [
-    os.path.join(baseDataDir, "train", "images", f)
-    for f in os.listdir(os.path.join(baseDataDir, "train", "images"))
-    if f.endswith((".jpg", ".png"))
-]
-trainMaskPaths = [
-    os.path.join(baseDataDir, "train", "masks", f)
-    for f in os.listdir(os.path.join(baseDataDir, "train", "masks"))
-    if f.endswith((".jpg", ".png"))
-]
-
-testImagePaths = [
-    os.path.join(baseDataDir, "test", "images", f)
-    for f in os.listdir(os.path.join(baseDataDir, "test", "images"))
-    if f.endswith((".jpg", ".png"))
-]
-testMaskPaths = [
-    os.path.join(baseDataDir, "test", "masks", f)
-    for f in os.listdir(os.path.join(baseDataDir, "test", "masks"))
-    if f.endswith((".jpg", ".png"))
-]
-
-valImagePaths = [
-    os.path.join(baseDataDir, "val", "images", f)
-    for f in os.listdir(os.path.join(baseDataDir, "val", "images"))
-    if f.endswith((".jpg", ".png"))
-]
-valMaskPaths = [
-    os.path.join(baseDataDir, "val", "masks", f)
-    for f in os.listdir(os.path.join(baseDataDir, "val", "masks"))
-    if f.endswith((".jpg", ".png"))
-]
+
+# Build split paths from the in-memory split lists instead of re-listing temp/
+def split_paths(split):
+    files = splits[split]
+    image_paths = [os.path.join(baseDataDir, split, "images", f) for f in files]
+    mask_paths = [
+        os.path.join(baseDataDir, split, "masks", mask_map[Path(f).stem]) for f in files
+    ]
+    return image_paths, mask_paths
+
+
+trainImagePaths, trainMaskPaths = split_paths("train")
+testImagePaths, testMaskPaths = split_paths("test")
+valImagePaths, valMaskPaths = split_paths("val")
+
+# Split manifest for train.py, so it doesn't re-list temp/ (which may also hold
+# files linked by a previous run with another seed)
+with open(os.path.join(baseDataDir, "splits.json"), "w") as f:
+    json.dump(
+        {split: dict(zip(("images", "masks"), split_paths(split))) for split in splits},
+        f,
+    )
 
 trainDataset = WMSDataset(trainImagePaths, trainMaskPaths, valTransforms)
 testDataset = WMSDataset(testImagePaths, testMaskPaths, valTransforms)
@@ -117,23 +124,28 @@ print(f"trainDataset length(train part): {len(trainDataset)}")
 print(f"testDataset length(train part): {len(testDataset)}")
 print(f"valDataset length(train part): {len(valDataset)}")
 
-dataLoader = DataLoader(trainDataset, batch_size=5, shuffle=True)
-images, masks = next(iter(dataLoader))
-
 
 ############### DATA VERIFICATION ###############
+def mask_class_counts(mask_path):
+    mask_img = cv2.imread(mask_path, 0)  # Load mask as grayscale
+    if mask_img is None:
+        print(f"Warning: Could not load {mask_path}")
+        return None
+    # Apply same thresholding as in WMSDataset to avoid JPEG compression artifacts
+    mask_img = (mask_img >= 127).astype(np.uint8)
+    return np.bincount(mask_img.ravel(), minlength=2)  # O(N), no sort
+
+
 def count_pixel_balance(mask_paths, dataset_name):
     counts = defaultdict(int)
-    for mask_path in mask_paths:
-        mask_img = cv2.imread(mask_path, 0)  # Load mask as grayscale
-        if mask_img is None:
-            print(f"Warning: Could not load {mask_path}")
-            continue
-        # Apply same thresholding as in WMSDataset to avoid JPEG compression artifacts
-        mask_img = (mask_img >= 127).astype(np.uint8)
-        unique, cnts = np.unique(mask_img, return_counts=True)
-        for cls, count in zip(unique, cnts):
-            counts[cls] += count
+    # cv2.imread releases the GIL, so threads overlap the mask decodes
+    with ThreadPoolExecutor() as pool:
+        for class_counts in pool.map(mask_class_counts, mask_paths):
+            if class_counts is None:
+                continue
+            for cls, count in enumerate(class_counts):
+                if count:
+                    counts[cls] += int(count)
     print(f"\nPixel distribution for the set {dataset_name}:")
     for cls, count in sorted(counts.items()):
         print(f"Class {cls}: {count} pixels")
@@ -151,7 +163,7 @@ def count_pixel_balance(mask_paths, dataset_name):
         os.path.join(results_dir, f"plot_pixel_balance_{dataset_name.lower()}.png")
     )
     print(f"  → Saved plot_pixel_balance_{dataset_name.lower()}.png")
-    plt.show()
+    plt.close()  # Agg backend: show() is a no-op, close() frees the figure
 
 
 ############### DEVICE CONFIGURATION ###############
@@ -159,9 +171,22 @@ def count_pixel_balance(mask_paths, dataset_name):
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 # determine if we will be pinning memory during data loading
 PIN_MEMORY = True if DEVICE == "cuda" else False
+# loader worker processes, capped to keep pinned-memory RSS bounded
+NUM_WORKERS = min(os.cpu_count() or 1, 4)
 
 ############### VISUALIZATION (only when run directly) ###############
 if __name__ == "__main__":
+    # Created under __main__ so spawned workers (Windows) don't re-run it on import
+    dataLoader = DataLoader(
+        trainDataset,
+        batch_size=5,
+        shuffle=True,
+        pin_memory=PIN_MEMORY,
+        num_workers=NUM_WORKERS,
+        persistent_workers=NUM_WORKERS > 0,
+    )
+    images, masks = next(iter(dataLoader))
+
     # Count balances
     count_pixel_balance(trainMaskPaths, "Train")
     count_pixel_balance(valMaskPaths, "Validation")
@@ -185,7 +210,7 @@ if __name__ == "__main__":
     plt.tight_layout()
     plt.savefig(os.path.join(results_dir, "plot_dataset_split.png"))
     print(f"  → Saved plot_dataset_split.png")
-    plt.show()
+    plt.close()
 
     # Sample images grid
     fig, axs = plt.subplots(5, 2, figsize=(10, 20))
@@ -201,7 +226,7 @@ if __name__ == "__main__":
     plt.tight_layout()
     plt.savefig(os.path.join(results_dir, "plot_samples.png"))
     print(f"  → Saved plot_samples.png")
-    plt.show()
+    plt.close()
 
     # PyTorch info
     print(f"\nPyTorch version: {torch.__version__}")
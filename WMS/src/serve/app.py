@@ -3,22 +3,40 @@ FastAPI serving application for Water Meters Segmentation model.
 
 Endpoints:
 - GET /health: Health check
-- POST /predict: Predict segmentation mask from uploaded image
+- POST /predict_raw: Predict segmentation mask, returned as raw PNG bytes
+- POST /predict: Same, with the mask base64-encoded in JSON (deprecated)
 - GET /metrics: Prometheus metrics
 
 Environment variables:
-- MODEL_PATH: Path to model weights (default: best.pth from MLflow or local)
+- MODEL_PATH: Path to model weights (default: best.pth from MLflow or local);
+  a TensorRT .plan engine (WMS/scripts/export_trt.py) is run with TensorRT on CUDA
 - MLFLOW_TRACKING_URI: MLflow server URI (optional)
 - MODEL_VERSION: Model version to load from MLflow (optional)
+- QUANTIZE_INT8: "1" to serve an INT8-quantized model on CPU (optional)
+- QUANT_CALIB_DIR: Directory with sample images used to calibrate INT8 ranges
+- QUANT_CALIB_SAMPLES: Max number of calibration images (default: 100)
+- B_MAX: Max number of concurrent requests batched into one forward (default: 8, 1 disables)
+- TAU_MS: How long the batcher waits to fill a batch, in milliseconds (default: 5)
+- MASK_CACHE_SIZE: Number of masks cached by upload SHA-256 (default: 256, 0 disables)
+- WORKERS: uvicorn worker processes for `python -m WMS.src.serve.app` (default: 1);
+  the usable CPU cores are split evenly between workers. Each worker loads its own
+  model and keeps its own Prometheus metrics and mask cache
 """
 
 import os
 import io
+import copy
+import asyncio
 import base64
+import hashlib
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 
+import cv2
 import torch
 import numpy as np
 from PIL import Image
@@ -32,13 +50,30 @@ from prometheus_client import (
     CONTENT_TYPE_LATEST,
 )
 
+try:
+    # SIMD (SSSE3/AVX2) base64 encoder, fused with the str conversion
+    from pybase64 import b64encode_as_string
+except ImportError:
+
+    def b64encode_as_string(data: bytes) -> str:
+        return base64.b64encode(data).decode("ascii")
+
+
+try:
+    # orjson (Rust) serializes the long mask_base64 string much faster than stdlib json
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+except ImportError:
+    DefaultResponse = JSONResponse
+
+
 # Import model and transforms from parent directory
 import sys
 
 sys.path.append(str(Path(__file__).parent.parent.parent))
 sys.path.append(str(Path(__file__).parent.parent))  # so "model" resolves for pickle
-from WMS.src.model import WaterMetersUNet
-from WMS.src.transforms import valTransforms
+from WMS.src.model import WaterMetersUNet, arch_from_state_dict, fuse_conv_bn
+from WMS.src.transforms import GPUPreprocessor, valResizedTransforms
 
 # Register "model" as alias so torch.load can unpickle models saved by train.py
 # (train.py uses `from model import WaterMetersUNet`, pickle records module as "model")
@@ -56,6 +91,9 @@ predict_latency = Histogram(
 predict_errors = Counter(
     "wms_predict_errors_total", "Total number of prediction errors"
 )
+mask_cache_hits = Counter(
+    "wms_mask_cache_hits_total", "Predictions answered from the upload hash cache"
+)
 model_loaded = Gauge("wms_model_loaded", "Model loaded status (1=loaded, 0=not loaded)")
 
 # =============================================================================
@@ -65,11 +103,44 @@ app = FastAPI(
     title="Water Meters Segmentation API",
     description="Segmentation API for water meter detection using U-Net",
     version="1.0.0",
+    default_response_class=DefaultResponse,
 )
 
 # Global model variable
 model: Optional[torch.nn.Module] = None
 device: torch.device = None
+amp_dtype: torch.dtype = torch.bfloat16  # CUDA autocast dtype, see initialize_model
+copy_stream: Optional[torch.cuda.Stream] = None  # CUDA side stream for batch uploads
+gpu_preprocessor: Optional[GPUPreprocessor] = None  # for JPEGs decoded with nvJPEG
+gpu_decode_lock = threading.Lock()  # one nvJPEG decode at a time across pool threads
+
+# Worker processes (see __main__) and the CPU cores each of them may use; the affinity
+# mask (unlike os.cpu_count) reflects a container's cpuset
+WORKERS = max(1, int(os.environ.get("WORKERS", 1)))
+CPUS = (
+    len(os.sched_getaffinity(0))
+    if hasattr(os, "sched_getaffinity")
+    else os.cpu_count() or 1
+)
+CPUS_PER_WORKER = max(1, CPUS // WORKERS)
+
+# Dynamic batching of concurrent /predict requests (started on app startup)
+B_MAX = int(os.environ.get("B_MAX", 8))
+TAU_MS = float(os.environ.get("TAU_MS", 5))
+batcher = None
+
+# LRU of upload SHA-256 -> (mask PNG bytes, input size), for re-uploaded images
+MASK_CACHE_SIZE = int(os.environ.get("MASK_CACHE_SIZE", 256))
+mask_cache: "OrderedDict[bytes, Tuple[bytes, Tuple[int, int]]]" = OrderedDict()
+
+# Threads for the CPU-bound decode/preprocess and postprocess/encode steps, so they
+# don't block the event loop (created on startup; None -> asyncio's default executor)
+preprocess_pool: Optional[ThreadPoolExecutor] = None
+
+# The one thread every forward (and the torch.compile warm-up) runs on: the CUDA
+# graphs recorded by torch.compile(mode="reduce-overhead") are per thread, so
+# forwards spread over a pool would each record their own set
+inference_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
 
 
 # =============================================================================
@@ -79,16 +150,23 @@ def load_model_from_path(model_path: str) -> torch.nn.Module:
     """Load model from local path."""
     print(f"Loading model from: {model_path}")
 
-    # Initialize model
-    model = WaterMetersUNet(inChannels=3, baseFilters=16, outChannels=1)
-
     # Load weights
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"Model file not found: {model_path}")
 
-    checkpoint = torch.load(model_path, map_location=device)
-    model.load_state_dict(checkpoint)
-    model.to(device)
+    # mmap: tensors are paged in straight from the file; weights_only: the file is a
+    # plain state_dict, so skip the generic unpickler
+    checkpoint = torch.load(
+        model_path, map_location=device, mmap=True, weights_only=True
+    )
+
+    # Initialize model with the layout the checkpoint was trained with
+    model = WaterMetersUNet(
+        inChannels=3, baseFilters=16, outChannels=1, **arch_from_state_dict(checkpoint)
+    )
+    # assign: take the loaded (already on-device) tensors instead of copying into
+    # freshly initialized CPU parameters, so no .to(device) is needed afterwards
+    model.load_state_dict(checkpoint, assign=True)
     model.eval()
 
     print(f"Model loaded successfully from {model_path}")
@@ -120,22 +198,274 @@ def load_model_from_mlflow(model_version: str = "production") -> torch.nn.Module
         raise
 
 
+def load_trt_engine(engine_path: str):
+    """
+    Load a TensorRT engine built by WMS/scripts/export_trt.py.
+
+    Returns None (caller falls back to PyTorch) when not on CUDA, when tensorrt
+    is not installed or when the engine can't be deserialized on this GPU.
+    """
+    if device.type != "cuda":
+        print("WARNING: TensorRT engines need CUDA, falling back to PyTorch")
+        return None
+    try:
+        from WMS.src.serve.trt_engine import TRTInferencer
+
+        engine = TRTInferencer(engine_path, device)
+        print(f"TensorRT engine loaded from {engine_path}")
+        return engine
+    except Exception as e:
+        print(f"WARNING: TensorRT unavailable, falling back to PyTorch: {e}")
+        return None
+
+
+def quantize_model(model: torch.nn.Module, weights_path: Optional[str] = None):
+    """
+    Post-training static INT8 quantization for CPU serving (FX graph mode).
+
+    Conv+BN+ReLU are fused and activation ranges calibrated on up to
+    QUANT_CALIB_SAMPLES images from QUANT_CALIB_DIR. The result is cached as
+    TorchScript next to the weights (<weights>.int8.pt) and reused while it is
+    newer than them. Returns None (caller keeps FP32) if quantization isn't possible.
+    """
+    cache_path = (
+        str(Path(weights_path).with_suffix(".int8.pt")) if weights_path else None
+    )
+    if (
+        cache_path
+        and os.path.exists(cache_path)
+        and os.path.getmtime(cache_path) >= os.path.getmtime(weights_path)
+    ):
+        print(f"Loading cached INT8 model from {cache_path}")
+        return torch.jit.load(cache_path, map_location="cpu")
+
+    calib_dir = os.environ.get("QUANT_CALIB_DIR")
+    max_samples = int(os.environ.get("QUANT_CALIB_SAMPLES", 100))
+    calib_files = []
+    if calib_dir and os.path.isdir(calib_dir):
+        calib_files = sorted(
+            f
+            for f in os.listdir(calib_dir)
+            if f.lower().endswith((".jpg", ".jpeg", ".png"))
+        )[:max_samples]
+    if not calib_files:
+        print(
+            "WARNING: QUANTIZE_INT8 needs calibration images in QUANT_CALIB_DIR, serving FP32"
+        )
+        return None
+
+    try:
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+        # x86 = fbgemm/oneDNN int8 kernels (VNNI where available); qnnpack on ARM
+        engines = torch.backends.quantized.supported_engines
+        backend = "x86" if "x86" in engines else "qnnpack"
+        torch.backends.quantized.engine = backend
+
+        example = torch.zeros(1, 3, 512, 512)
+        prepared = prepare_fx(
+            copy.deepcopy(model).cpu().eval(),
+            get_default_qconfig_mapping(backend),
+            example_inputs=(example,),
+        )
+        with torch.inference_mode():
+            for fname in calib_files:
+                calib_image = Image.open(os.path.join(calib_dir, fname)).convert("RGB")
+                prepared(preprocess_image(calib_image))
+        quantized = torch.jit.trace(convert_fx(prepared), example)
+        print(
+            f"Model quantized to INT8 ({backend}, {len(calib_files)} calibration images)"
+        )
+    except Exception as e:
+        print(f"WARNING: INT8 quantization failed, serving FP32: {e}")
+        return None
+
+    if cache_path:
+        try:
+            torch.jit.save(quantized, cache_path)
+            print(f"Cached INT8 model to {cache_path}")
+        except OSError as e:
+            print(f"WARNING: could not cache INT8 model: {e}")
+    return quantized
+
+
+class CUDAGraphModel:
+    """
+    Replay CUDA graphs of the model captured once per batch size.
+
+    Same call convention as the model. A batch is copied into the static input of
+    the smallest captured size that fits it, the graph replays the whole forward
+    with a single launch and the first B rows of the static output are returned.
+    """
+
+    def __init__(self, model: torch.nn.Module, batch_sizes):
+        self.graphs = {}
+        pool = torch.cuda.graph_pool_handle()  # graphs share one memory pool
+        compute_stream = torch.cuda.current_stream(device)
+        # Largest first, so the smaller graphs fit into the pool it allocated
+        for batch_size in sorted(batch_sizes, reverse=True):
+            static_in = torch.zeros(batch_size, 3, 512, 512, device=device).to(
+                memory_format=torch.channels_last
+            )
+            with torch.inference_mode(), torch.autocast(
+                device_type="cuda", dtype=amp_dtype
+            ):
+                # Warm up on a side stream (cuDNN autotuning, lazy init) before capture
+                warmup_stream = torch.cuda.Stream(device)
+                warmup_stream.wait_stream(compute_stream)
+                with torch.cuda.stream(warmup_stream):
+                    for _ in range(3):
+                        model(static_in)
+                compute_stream.wait_stream(warmup_stream)
+
+                graph = torch.cuda.CUDAGraph()
+                with torch.cuda.graph(graph, pool=pool):
+                    static_out = model(static_in)
+            self.graphs[batch_size] = (graph, static_in, static_out)
+        self.batch_sizes = sorted(self.graphs)
+        self.max_batch_size = self.batch_sizes[-1]
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        n = x.shape[0]
+        batch_size = next(b for b in self.batch_sizes if b >= n)
+        graph, static_in, static_out = self.graphs[batch_size]
+        static_in[:n].copy_(x)  # rows past n keep stale data; their outputs are dropped
+        graph.replay()
+        # Copy out so the next replay can't overwrite a result still in use
+        return static_out[:n].clone()
+
+
+def compile_model(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Compile model with torch.compile for fixed (B, 3, 512, 512) inputs, B <= B_MAX.
+
+    torch.compile is only used on CUDA (reduce-overhead mode relies on CUDA
+    graphs); on CPU the model is traced and frozen with TorchScript instead.
+    If torch.compile is unavailable or fails on CUDA, CUDA graphs of the eager
+    model are captured directly (CUDAGraphModel). Falls back to the eager model
+    if that fails too.
+    """
+    if device.type == "cpu":
+        return trace_model(model)
+    if device.type != "cuda":
+        return model
+    if hasattr(torch, "compile"):
+        compiled = _torch_compile(model)
+        if compiled is not None:
+            return compiled
+
+    try:
+        # Powers of two up to B_MAX (plus B_MAX); partial batches run padded
+        max_batch_size = max(B_MAX, 1)
+        batch_sizes = {
+            min(2**i, max_batch_size) for i in range(max_batch_size.bit_length() + 1)
+        }
+        graphed = CUDAGraphModel(model, batch_sizes)
+        print(f"Model captured as CUDA graphs (batch sizes {graphed.batch_sizes})")
+        return graphed
+    except Exception as e:
+        print(f"WARNING: CUDA graph capture failed, using eager model: {e}")
+        return model
+
+
+def _warm_up(compiled: torch.nn.Module):
+    # Each size twice: the first call compiles, the second records its CUDA graph
+    with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=amp_dtype):
+        for batch_size in range(1, max(B_MAX, 1) + 1):
+            dummy = torch.zeros(batch_size, 3, 512, 512, device=device).to(
+                memory_format=torch.channels_last
+            )
+            for _ in range(2):
+                compiled(dummy)
+
+
+def _torch_compile(model: torch.nn.Module) -> Optional[torch.nn.Module]:
+    """
+    torch.compile(mode="reduce-overhead") + warm-up; None if compilation fails.
+
+    With dynamic=False every batch size 1..B_MAX is its own compiled graph, so
+    dynamo's recompile limit (8 by default) is raised to B_MAX; past the limit
+    the extra sizes would silently run eager.
+    """
+    try:
+        limit = torch._dynamo.config.cache_size_limit
+        torch._dynamo.config.cache_size_limit = max(limit, B_MAX)
+        compiled = torch.compile(
+            model, mode="reduce-overhead", fullgraph=True, dynamic=False
+        )
+        # Warm up every batch size the batcher can produce, on the inference thread,
+        # so compilation and CUDA graph capture happen before the first request
+        inference_pool.submit(_warm_up, compiled).result()
+        print("Model compiled with torch.compile (mode=reduce-overhead)")
+        return compiled
+    except Exception as e:
+        print(f"WARNING: torch.compile failed: {e}")
+        return None
+
+
+def trace_model(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Trace model with TorchScript and run torch.jit.optimize_for_inference (CPU).
+
+    Freezing inlines the weights as constants, after which the CPU passes fold
+    the remaining elementwise ops into the convs and cut per-op dispatch overhead.
+    """
+    try:
+        example = torch.zeros(1, 3, 512, 512).to(memory_format=torch.channels_last)
+        with torch.no_grad():
+            traced = torch.jit.optimize_for_inference(torch.jit.trace(model, example))
+            # Profiling executor specializes on the first calls; do them before requests
+            for _ in range(2):
+                traced(example)
+        print("Model traced with TorchScript (optimize_for_inference)")
+        return traced
+    except Exception as e:
+        print(f"WARNING: TorchScript tracing failed, using eager model: {e}")
+        return model
+
+
 def initialize_model():
     """Initialize model on startup."""
-    global model, device
+    global model, device, amp_dtype, copy_stream, gpu_preprocessor
 
     # Set device
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print(f"Using device: {device}")
+    # Don't let WORKERS processes each spin up a thread per core
+    torch.set_num_threads(CPUS_PER_WORKER)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:  # already set / inter-op pool already started
+        pass
+    # BF16 Tensor Cores need Ampere+ (sm_80); older GPUs (e.g. T4) get FP16 ones
+    if device.type == "cuda" and torch.cuda.get_device_capability(device)[0] < 8:
+        amp_dtype = torch.float16
+    if device.type == "cuda":
+        copy_stream = torch.cuda.Stream(device)
+        gpu_preprocessor = GPUPreprocessor().to(device)
 
     # Try loading model
     model_path = os.environ.get("MODEL_PATH")
     model_version = os.environ.get("MODEL_VERSION")
+    weights_path = None  # local weights file, if any (keys the INT8 cache)
 
     try:
+        if model_path and model_path.endswith(".plan") and os.path.exists(model_path):
+            engine = load_trt_engine(model_path)
+            if engine is not None:
+                # Already fused + specialised by TensorRT, skip the PyTorch optimisations
+                model = engine
+                model_loaded.set(1)
+                print("Model initialization complete")
+                return
+            # Fall back to the weights the engine was exported from
+            model_path = str(Path(model_path).with_suffix(".pth"))
+
         if model_path and os.path.exists(model_path):
             # Load from local path
             model = load_model_from_path(model_path)
+            weights_path = model_path
         elif model_version:
             # Load from MLflow
             model = load_model_from_mlflow(model_version)
@@ -145,6 +475,7 @@ def initialize_model():
             for path in default_paths:
                 if os.path.exists(path):
                     model = load_model_from_path(path)
+                    weights_path = path
                     break
 
             if model is None:
@@ -153,6 +484,20 @@ def initialize_model():
                 model.to(device)
                 model.eval()
 
+        quantized = None
+        if device.type == "cpu" and os.environ.get("QUANTIZE_INT8") == "1":
+            quantized = quantize_model(model, weights_path)
+
+        if quantized is not None:
+            model = quantized  # Conv+BN+ReLU already fused by the quantization pass
+        else:
+            # Fold BatchNorm into the preceding conv (drops 18 BN ops from the forward)
+            model = fuse_conv_bn(model)
+            # NHWC layout lets cuDNN dispatch Tensor-Core friendly kernels for the 3x3 convs
+            model = model.to(memory_format=torch.channels_last)
+            torch.backends.cudnn.benchmark = True  # fixed 512x512 input, autotune once
+            model = compile_model(model)
+
         model_loaded.set(1)
         print("Model initialization complete")
 
@@ -175,11 +520,13 @@ def preprocess_image(image: Image.Image) -> torch.Tensor:
     Returns:
         torch.Tensor: Preprocessed image tensor (1, 3, 512, 512)
     """
-    # Convert to numpy array
-    image_np = np.array(image)
+    # Resize the uint8 PIL image first (same bilinear resize as valTransforms), so
+    # full-resolution uploads are never copied to numpy or converted to float
+    if image.size != (512, 512):
+        image = image.resize((512, 512), Image.BILINEAR)
 
-    # Apply validation transforms (resize, normalize, etc.)
-    image_tensor = valTransforms(image_np)
+    # Apply the rest of the validation transforms (contrast stretch, median blur)
+    image_tensor = valResizedTransforms(image)
 
     # Add batch dimension
     image_tensor = image_tensor.unsqueeze(0)
@@ -187,6 +534,202 @@ def preprocess_image(image: Image.Image) -> torch.Tensor:
     return image_tensor
 
 
+def upload_batch(tensors, host_buffer: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """
+    Concatenate (1, 3, 512, 512) CPU tensors into one batch and start its upload.
+
+    On CUDA the batch is assembled in pinned memory (`host_buffer` if given, sized
+    to the batch) and copied on copy_stream without blocking, so the copy overlaps
+    with the previous batch's forward.
+    """
+    if copy_stream is None:
+        return torch.cat(tensors)
+    if any(t.is_cuda for t in tensors):
+        # Some uploads were decoded on the GPU already: assemble the batch there
+        return torch.cat([t.to(device, non_blocking=True) for t in tensors])
+
+    batch = host_buffer
+    if batch is None:
+        batch = torch.empty(
+            (len(tensors), *tensors[0].shape[1:]),
+            dtype=tensors[0].dtype,
+            pin_memory=True,
+        )
+    torch.cat(tensors, out=batch)
+    with torch.cuda.stream(copy_stream):
+        return batch.to(device, memory_format=torch.channels_last, non_blocking=True)
+
+
+def run_inference(image_tensor: torch.Tensor) -> torch.Tensor:
+    """Run the model on a (B, 3, 512, 512) batch and return FP32 logits."""
+    if image_tensor.is_cuda and copy_stream is not None:
+        # Uploaded by upload_batch: wait for the copy, keep the memory alive on this stream
+        compute_stream = torch.cuda.current_stream(device)
+        compute_stream.wait_stream(copy_stream)
+        image_tensor.record_stream(compute_stream)
+    image_tensor = image_tensor.to(
+        device, memory_format=torch.channels_last, non_blocking=True
+    )
+
+    # Inference (BF16/FP16 autocast on CUDA; plain FP32 on CPU)
+    with torch.inference_mode(), torch.autocast(
+        device_type=device.type,
+        dtype=amp_dtype,
+        enabled=device.type == "cuda",
+    ):
+        output = model(image_tensor)
+    return output.float()  # keep sigmoid + threshold in FP32
+
+
+class DynamicBatcher:
+    """
+    Coalesce concurrent requests into a single model(batch) call.
+
+    submit() queues a (1, 3, 512, 512) tensor and awaits its logits. A background
+    task takes the first queued request, waits up to `max_delay` seconds for more
+    (at most `max_batch_size` in total), runs them as one batch on the inference thread
+    (the event loop keeps accepting requests meanwhile) and hands each caller its slice.
+    The next batch is collected while the current one is running and its upload is
+    queued on the inference thread right behind it (the wait for a free pinned buffer
+    never blocks the event loop); forwards themselves never run concurrently. On CUDA,
+    batches are staged in two pinned host buffers allocated once in start() and used
+    alternately.
+    """
+
+    def __init__(self, max_batch_size: int = 8, max_delay: float = 0.005):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.pending: Optional[asyncio.Task] = None  # forward currently running
+        self.host_buffers = []
+        self.copy_events = []  # per buffer: upload that last read from it
+        self.slot = 0
+
+    def start(self):
+        if copy_stream is not None:
+            shape = (self.max_batch_size, 3, 512, 512)
+            self.host_buffers = [torch.empty(shape, pin_memory=True) for _ in range(2)]
+            self.copy_events = [None, None]
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    def _upload(self, tensors) -> torch.Tensor:
+        if not self.host_buffers:
+            return upload_batch(tensors)
+        slot, self.slot = self.slot, self.slot ^ 1
+        if self.copy_events[slot] is not None:
+            self.copy_events[slot].synchronize()  # previous upload from it is done
+        batch = upload_batch(tensors, self.host_buffers[slot][: len(tensors)])
+        self.copy_events[slot] = copy_stream.record_event()
+        return batch
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.pending is not None:
+            await self.pending  # let the in-flight batch answer its callers
+            self.pending = None
+
+    async def submit(self, image_tensor: torch.Tensor) -> torch.Tensor:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image_tensor, future))
+        return await future
+
+    async def _collect(self):
+        items = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(items) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            tensors, futures = zip(*items)
+            try:
+                # One host->device copy for the whole batch
+                batch = await loop.run_in_executor(
+                    inference_pool, self._upload, tensors
+                )
+            except Exception as e:
+                self._fail(futures, e)
+                continue
+            if self.pending is not None:
+                await self.pending
+            self.pending = asyncio.create_task(self._forward(batch, futures))
+
+    async def _forward(self, batch: torch.Tensor, futures):
+        loop = asyncio.get_running_loop()
+        try:
+            outputs = await loop.run_in_executor(inference_pool, run_inference, batch)
+        except Exception as e:
+            self._fail(futures, e)
+            return
+        for i, future in enumerate(futures):
+            if not future.done():  # caller may have gone away
+                future.set_result(outputs[i].unsqueeze(0))
+
+    @staticmethod
+    def _fail(futures, error: Exception):
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+
+
+def decode_jpeg_on_gpu(
+    image_bytes: bytes,
+) -> Optional[Tuple[torch.Tensor, Tuple[int, int]]]:
+    """
+    Decode a JPEG upload with nvJPEG and preprocess it on the GPU.
+
+    GPUPreprocessor is the batched GPU port of valTransforms, so full-resolution
+    photos never pass through host memory as pixels. Returns (tensor, (width,
+    height)), or None (caller uses the PIL path) for non-JPEG uploads, on CPU, or
+    if torchvision can't decode on GPU.
+    """
+    if gpu_preprocessor is None or image_bytes[:3] != b"\xff\xd8\xff":
+        return None
+    try:
+        from torchvision.io import ImageReadMode, decode_jpeg
+
+        data = torch.frombuffer(bytearray(image_bytes), dtype=torch.uint8)
+        with gpu_decode_lock:
+            image = decode_jpeg(data, mode=ImageReadMode.RGB, device=device)
+        return gpu_preprocessor([image]), (image.shape[2], image.shape[1])
+    except Exception as e:
+        print(f"WARNING: GPU JPEG decode failed, using PIL: {e}")
+        return None
+
+
+def decode_and_preprocess(image_bytes: bytes) -> Tuple[torch.Tensor, Tuple[int, int]]:
+    """Decode an uploaded image and preprocess it; returns (tensor, (width, height))."""
+    decoded = decode_jpeg_on_gpu(image_bytes)
+    if decoded is not None:
+        return decoded
+
+    image_pil = Image.open(io.BytesIO(image_bytes))
+
+    # Convert to RGB if needed
+    if image_pil.mode != "RGB":
+        image_pil = image_pil.convert("RGB")
+
+    return preprocess_image(image_pil), image_pil.size
+
+
 def postprocess_mask(output: torch.Tensor) -> np.ndarray:
     """
     Postprocess model output to binary mask.
@@ -197,29 +740,25 @@ def postprocess_mask(output: torch.Tensor) -> np.ndarray:
     Returns:
         np.ndarray: Binary mask (512, 512) with values 0/255
     """
-    # Apply sigmoid to get probabilities
-    probs = torch.sigmoid(output)
-
-    # Threshold at 0.5
-    binary_mask = (probs > 0.5).float()
+    # sigmoid(x) > 0.5 <=> x > 0: threshold the logits directly and go straight
+    # to a 0/255 uint8 mask, so only 1 byte/pixel is copied back to the host
+    mask_uint8 = (output.squeeze() > 0).to(torch.uint8).mul_(255)
 
-    # Convert to numpy and remove batch/channel dimensions
-    mask_np = binary_mask.squeeze().cpu().numpy()
+    return mask_uint8.contiguous().cpu().numpy()
 
-    # Convert to 0-255 range
-    mask_uint8 = (mask_np * 255).astype(np.uint8)
 
-    return mask_uint8
+def mask_to_png(mask: np.ndarray) -> bytes:
+    """Encode a 0/255 mask array as PNG (8-bit grayscale)."""
+    # Encode straight from the array (no PIL copy)
+    ok, buffer = cv2.imencode(".png", mask, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    if not ok:
+        raise ValueError("PNG encoding failed")
+    return buffer.tobytes()
 
 
 def mask_to_base64(mask: np.ndarray) -> str:
-    """Convert mask array to base64 encoded PNG."""
-    mask_image = Image.fromarray(mask, mode="L")
-    buffer = io.BytesIO()
-    mask_image.save(buffer, format="PNG")
-    buffer.seek(0)
-    mask_base64 = base64.b64encode(buffer.read()).decode("utf-8")
-    return mask_base64
+    """Convert a 0/255 mask array to base64 encoded PNG (8-bit grayscale)."""
+    return b64encode_as_string(mask_to_png(mask))
 
 
 # =============================================================================
@@ -228,7 +767,30 @@ def mask_to_base64(mask: np.ndarray) -> str:
 @app.on_event("startup")
 async def startup_event():
     """Initialize model on startup."""
+    global batcher, preprocess_pool
     initialize_model()
+    preprocess_pool = ThreadPoolExecutor(
+        max_workers=CPUS_PER_WORKER, thread_name_prefix="preprocess"
+    )
+
+    # Static-shape engines (TensorRT) cap the batch size
+    max_batch_size = min(B_MAX, getattr(model, "max_batch_size", B_MAX))
+    if max_batch_size > 1:
+        batcher = DynamicBatcher(max_batch_size, TAU_MS / 1000.0)
+        batcher.start()
+        print(f"Dynamic batching enabled (B_MAX={max_batch_size}, TAU={TAU_MS}ms)")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the batching task and the preprocessing threads."""
+    global batcher, preprocess_pool
+    if batcher is not None:
+        await batcher.stop()
+        batcher = None
+    if preprocess_pool is not None:
+        preprocess_pool.shutdown(wait=False)
+        preprocess_pool = None
 
 
 @app.get("/")
@@ -331,18 +893,16 @@ predictBtn.addEventListener('click', async () => {
     formData.append('image', file);
 
     try {
-      const res = await fetch('/predict', { method: 'POST', body: formData });
+      const res = await fetch('/predict_raw', { method: 'POST', body: formData });
       if (!res.ok) { const e = await res.json(); throw new Error(e.detail || res.statusText); }
-      const data = await res.json();
+      const maskBlob = await res.blob();
+      const latency = res.headers.get('X-Latency');
 
       const origUrl = URL.createObjectURL(file);
-      const maskUrl = 'data:image/png;base64,' + data.mask_base64;
+      const maskUrl = URL.createObjectURL(maskBlob);
 
-      const raw = atob(data.mask_base64);
-      const arr = new Uint8Array(raw.length);
-      for (let j = 0; j < raw.length; j++) arr[j] = raw.charCodeAt(j);
       const maskName = 'mask_' + file.name.replace(/\\.[^.]+$/, '.png');
-      maskBlobs.push({ name: maskName, blob: new Blob([arr], { type: 'image/png' }) });
+      maskBlobs.push({ name: maskName, blob: maskBlob });
 
       const row = document.createElement('div');
       row.className = 'result-row';
@@ -352,7 +912,7 @@ predictBtn.addEventListener('click', async () => {
           <a href="${maskUrl}" download="${maskName}"
              style="margin-top:6px;font-size:.8rem;color:#3b82f6">Pobierz maskę</a>
         </div>
-        <div class="info">${file.name}<br>Latencja: ${data.metadata.latency_seconds}s</div>`;
+        <div class="info">${file.name}<br>Latencja: ${latency}s</div>`;
       resultsEl.appendChild(row);
     } catch (err) {
       const row = document.createElement('div');
@@ -399,25 +959,19 @@ async def health_check():
     }
 
 
-@app.post("/predict")
-async def predict(
-    image: Optional[UploadFile] = File(None),
-    file: Optional[UploadFile] = File(None),
-):
+async def segment_upload(
+    upload: Optional[UploadFile],
+) -> Tuple[bytes, Tuple[int, int], float]:
     """
-    Predict segmentation mask from uploaded image.
-
-    Args:
-        image/file: Uploaded image file (JPG, PNG)
+    Run the full prediction pipeline on an uploaded image.
 
     Returns:
-        JSON with base64-encoded mask and metadata
+        (mask PNG bytes, input (width, height), latency in seconds)
     """
     if model is None:
         predict_errors.inc()
         raise HTTPException(status_code=503, detail="Model not loaded")
 
-    upload = image or file
     if upload is None:
         predict_errors.inc()
         raise HTTPException(
@@ -430,44 +984,48 @@ async def predict(
     try:
         # Read and validate image
         image_bytes = await upload.read()
-        image_pil = Image.open(io.BytesIO(image_bytes))
-
-        # Convert to RGB if needed
-        if image_pil.mode != "RGB":
-            image_pil = image_pil.convert("RGB")
 
-        # Preprocess
-        image_tensor = preprocess_image(image_pil)
-        image_tensor = image_tensor.to(device)
+        # Same bytes -> same mask: skip decode + inference for re-uploads
+        digest = hashlib.sha256(image_bytes).digest()
+        cached = mask_cache.get(digest)
+        if cached is not None:
+            mask_cache.move_to_end(digest)
+            mask_cache_hits.inc()
+            latency = time.time() - start_time
+            predict_count.inc()
+            predict_latency.observe(latency)
+            return cached[0], cached[1], latency
+
+        # Decode + preprocess in a worker thread
+        loop = asyncio.get_running_loop()
+        image_tensor, input_size = await loop.run_in_executor(
+            preprocess_pool, decode_and_preprocess, image_bytes
+        )
 
-        # Inference
-        with torch.no_grad():
-            output = model(image_tensor)
+        # Inference, batched with other in-flight requests when the batcher is running
+        if batcher is not None:
+            output = await batcher.submit(image_tensor)
+        else:
+            output = await loop.run_in_executor(
+                inference_pool, run_inference, image_tensor
+            )
 
-        # Postprocess
-        mask = postprocess_mask(output)
+        # Postprocess + encode to PNG in a worker thread
+        mask_png = await loop.run_in_executor(
+            preprocess_pool, lambda: mask_to_png(postprocess_mask(output))
+        )
 
-        # Encode to base64
-        mask_base64 = mask_to_base64(mask)
+        if MASK_CACHE_SIZE > 0:
+            mask_cache[digest] = (mask_png, input_size)
+            if len(mask_cache) > MASK_CACHE_SIZE:
+                mask_cache.popitem(last=False)
 
         # Record metrics
         latency = time.time() - start_time
         predict_count.inc()
         predict_latency.observe(latency)
 
-        # Return response
-        return JSONResponse(
-            {
-                "status": "success",
-                "mask_base64": mask_base64,
-                "metadata": {
-                    "input_size": list(image_pil.size),
-                    "output_size": [512, 512],
-                    "latency_seconds": round(latency, 3),
-                    "device": str(device),
-                },
-            }
-        )
+        return mask_png, input_size, latency
 
     except Exception as e:
         predict_errors.inc()
@@ -475,6 +1033,64 @@ async def predict(
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 
+@app.post("/predict_raw")
+async def predict_raw(
+    image: Optional[UploadFile] = File(None),
+    file: Optional[UploadFile] = File(None),
+):
+    """
+    Predict segmentation mask from uploaded image.
+
+    Args:
+        image/file: Uploaded image file (JPG, PNG)
+
+    Returns:
+        The mask as image/png; metadata in X-Latency / X-Input-Size / X-Device headers
+    """
+    mask_png, (width, height), latency = await segment_upload(image or file)
+
+    return Response(
+        content=mask_png,
+        media_type="image/png",
+        headers={
+            "X-Latency": str(round(latency, 3)),
+            "X-Input-Size": f"{width}x{height}",
+            "X-Device": str(device),
+        },
+    )
+
+
+@app.post("/predict", deprecated=True)
+async def predict(
+    image: Optional[UploadFile] = File(None),
+    file: Optional[UploadFile] = File(None),
+):
+    """
+    Predict segmentation mask from uploaded image.
+
+    Deprecated: base64 inflates the mask by a third, use /predict_raw.
+
+    Args:
+        image/file: Uploaded image file (JPG, PNG)
+
+    Returns:
+        JSON with base64-encoded mask and metadata
+    """
+    mask_png, input_size, latency = await segment_upload(image or file)
+
+    # Return response (serialized by the app's default response class)
+    return {
+        "status": "success",
+        "mask_base64": b64encode_as_string(mask_png),
+        "metadata": {
+            "input_size": list(input_size),
+            "output_size": [512, 512],
+            "latency_seconds": round(latency, 3),
+            "device": str(device),
+        },
+    }
+
+
 @app.get("/metrics")
 async def metrics():
     """Prometheus metrics endpoint."""
@@ -487,4 +1103,5 @@ async def metrics():
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Import string, so each worker process loads its own copy of the app
+    uvicorn.run("WMS.src.serve.app:app", host="0.0.0.0", port=8000, workers=WORKERS)
@@ -0,0 +1,76 @@
+"""
+TensorRT runtime for .plan engines built by WMS/scripts/export_trt.py.
+
+Imported lazily by app.py, so the API still starts (on the PyTorch model) when
+the tensorrt package is not installed.
+"""
+
+import tensorrt as trt
+import torch
+
+_TORCH_DTYPES = {
+    trt.float32: torch.float32,
+    trt.float16: torch.float16,
+}
+
+
+class TRTInferencer:
+    """
+    Run a serialized TensorRT engine with the same call convention as the model:
+    logits = inferencer(image_tensor).
+
+    Engine I/O is bound straight to torch CUDA tensors and enqueued on the current
+    torch stream, so the only host->device copy is the caller's `.to(device)`.
+    The output buffer is allocated once and reused across requests.
+    """
+
+    def __init__(self, engine_path: str, device: torch.device):
+        self.device = device
+        self.logger = trt.Logger(trt.Logger.WARNING)
+        with open(engine_path, "rb") as f, trt.Runtime(self.logger) as runtime:
+            self.engine = runtime.deserialize_cuda_engine(f.read())
+        if self.engine is None:
+            raise RuntimeError(f"Could not deserialize TensorRT engine: {engine_path}")
+        self.context = self.engine.create_execution_context()
+
+        names = [
+            self.engine.get_tensor_name(i) for i in range(self.engine.num_io_tensors)
+        ]
+        inputs = [
+            n for n in names if self.engine.get_tensor_mode(n) == trt.TensorIOMode.INPUT
+        ]
+        outputs = [n for n in names if n not in inputs]
+        self.input_name, self.output_name = inputs[0], outputs[0]
+        self.input_shape = tuple(self.engine.get_tensor_shape(self.input_name))
+        self.max_batch_size = self.input_shape[0]  # static engine, see export_trt.py
+        self.input_dtype = _TORCH_DTYPES[self.engine.get_tensor_dtype(self.input_name)]
+
+        self.output = torch.empty(
+            tuple(self.engine.get_tensor_shape(self.output_name)),
+            dtype=_TORCH_DTYPES[self.engine.get_tensor_dtype(self.output_name)],
+            device=device,
+        )
+        self.context.set_tensor_address(self.output_name, self.output.data_ptr())
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        batch_size = x.shape[0]
+        if (
+            batch_size > self.max_batch_size
+            or tuple(x.shape[1:]) != self.input_shape[1:]
+        ):
+            raise ValueError(
+                f"TensorRT engine expects input {self.input_shape}, got {tuple(x.shape)}"
+            )
+        if batch_size < self.max_batch_size:
+            # Partial batch from the batcher: pad up to the engine's static batch size
+            padding = x.new_zeros((self.max_batch_size - batch_size, *x.shape[1:]))
+            x = torch.cat([x, padding])
+        # Engine was built from an NCHW export: drop channels_last, match the I/O dtype
+        x = x.to(self.device, dtype=self.input_dtype).contiguous()
+        self.context.set_tensor_address(self.input_name, x.data_ptr())
+
+        stream = torch.cuda.current_stream(self.device)
+        if not self.context.execute_async_v3(stream.cuda_stream):
+            raise RuntimeError("TensorRT inference failed")
+        # Copy out so the next request can't overwrite a result still in use
+        return self.output[:batch_size].clone()
@@ -8,6 +8,7 @@ if hasattr(sys.stdout, "reconfigure"):
 os.environ.setdefault("PYTHONIOENCODING", "utf-8")
 
 import torch
+import torch.distributed as dist
 import matplotlib
 
 matplotlib.use("Agg")
@@ -15,45 +16,66 @@ import matplotlib.pyplot as plt
 import numpy as np
 import argparse
 import json
+import hashlib
 import random
 import yaml
-import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import mlflow
 import mlflow.pytorch
+from mlflow.entities import Metric
+from mlflow.tracking import MlflowClient
 
 from torch import nn, optim
+from torch.nn.parallel import DistributedDataParallel as DDP
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
 from torchsummary import summary
-from scipy.spatial.distance import directed_hausdorff
-from model import WaterMetersUNet
-from dataset import WMSDataset
-from transforms import TrainTransforms, valTransforms
+from scipy.spatial import cKDTree
+from model import WaterMetersUNet, arch_from_state_dict
+from dataset import WMSDataset, DataPrefetcher, GPUDecodeLoader, raw_collate
+from build_cache import ensure_cache, get_data_version
+from transforms import TrainTransforms, valTransforms, GPUPreprocessor
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 
 
-# Dice coefficient
-def dice_coeff(pred, target, smooth=1e-6):
-    pred = pred.flatten()
-    target = target.flatten()
-    intersection = (pred * target).sum()  # 2*|pred ∩ GT| # GT - Ground Truth
-    return (2.0 * intersection + smooth) / (
-        pred.sum() + target.sum() + smooth
+# Pixel-wise accuracy
+def pixel_accuracy(pred, target):
+    return (pred == target).float().mean()
+
+
+# Dice coefficient of (N, 1, H, W) tensors, reduced on-device: mean over N, or per sample
+def dice_coeff_batch(pred, target, smooth=1e-6, reduce=True):
+    dims = (1, 2, 3)
+    intersection = (pred * target).sum(dims)  # |pred ∩ GT| # GT - Ground Truth
+    dice = (2.0 * intersection + smooth) / (
+        pred.sum(dims) + target.sum(dims) + smooth
     )  # 2*|pred ∩ GT|
+    return dice.mean() if reduce else dice
 
 
-# Intersection over Union
-def iou_coeff(pred, target, smooth=1e-6):
-    pred = pred.flatten()
-    target = target.flatten()
-    intersection = (pred * target).sum()  # |pred ∩ GT|
-    union = pred.sum() + target.sum() - intersection  # |pred| + |GT| − |pred ∩ GT|
-    return (intersection + smooth) / (union + smooth)  # smooth to avoid division by 0
+# Intersection over Union, same layout as dice_coeff_batch
+def iou_coeff_batch(pred, target, smooth=1e-6, reduce=True):
+    dims = (1, 2, 3)
+    intersection = (pred * target).sum(dims)  # |pred ∩ GT|
+    # |pred| + |GT| − |pred ∩ GT|
+    union = pred.sum(dims) + target.sum(dims) - intersection
+    iou = (intersection + smooth) / (union + smooth)  # smooth to avoid division by 0
+    return iou.mean() if reduce else iou
 
 
-# Pixel-wise accuracy
-def pixel_accuracy(pred, target):
-    return (pred == target).mean()
+def batch_metrics(loss, outputs, masks):
+    """[loss, pixel accuracy, Dice, IoU] of a batch as one tensor, without a host sync."""
+    preds = (outputs > 0).float()  # sigmoid(x) > 0.5 <=> x > 0
+    return torch.stack(
+        [
+            loss.detach().float(),
+            pixel_accuracy(preds, masks),
+            dice_coeff_batch(preds, masks),
+            iou_coeff_batch(preds, masks),
+        ]
+    )
 
 
 # Safe Hausdorff distance that handles empty masks
@@ -63,9 +85,14 @@ def safe_hausdorff(pred_mask, gt_mask):
     - If both masks are empty: return 0 (both agree there's nothing)
     - If one mask is empty and the other is not: return the image diagonal as max penalty
     - Otherwise: compute the standard Hausdorff distance
+
+    Takes (1, H, W) / (H, W) mask tensors on any device: foreground coordinates are
+    extracted where the masks live, only the coordinate lists reach the host.
     """
-    p_pts = np.argwhere(pred_mask.squeeze() == 1)
-    m_pts = np.argwhere(gt_mask.squeeze() == 1)
+    pred_mask = pred_mask.squeeze()
+    gt_mask = gt_mask.squeeze()
+    p_pts = torch.nonzero(pred_mask > 0.5)
+    m_pts = torch.nonzero(gt_mask > 0.5)
 
     pred_empty = len(p_pts) == 0
     gt_empty = len(m_pts) == 0
@@ -75,13 +102,15 @@ def safe_hausdorff(pred_mask, gt_mask):
         return 0.0
     elif pred_empty or gt_empty:
         # One mask is empty - return max possible distance (image diagonal)
-        h, w = pred_mask.squeeze().shape
+        h, w = pred_mask.shape
         return np.sqrt(h**2 + w**2)
     else:
-        # Both masks have points - compute standard Hausdorff
-        hd1 = directed_hausdorff(p_pts, m_pts)[0]
-        hd2 = directed_hausdorff(m_pts, p_pts)[0]
-        return max(hd1, hd2)
+        # Both masks have points - symmetric Hausdorff via nearest-neighbour queries
+        p_pts = p_pts.cpu().numpy()
+        m_pts = m_pts.cpu().numpy()
+        hd1 = cKDTree(m_pts).query(p_pts, k=1)[0].max()
+        hd2 = cKDTree(p_pts).query(m_pts, k=1)[0].max()
+        return float(max(hd1, hd2))
 
 
 # ---------------------------------------------------------------------------
@@ -94,11 +123,23 @@ def load_config(config_path):
         return yaml.safe_load(f)
 
 
-def get_data_version():
-    dvc_lock = Path("dvc.lock")
-    if dvc_lock.exists():
-        return hashlib.md5(dvc_lock.read_bytes()).hexdigest()[:8]
-    return "unknown"
+def get_split_version(seed):
+    """
+    Key of the split prepareDataset.py writes: the DVC pointers of the raw images and
+    masks (changed by dvc pull/checkout, unlike dvc.lock), the script itself and the seed.
+    """
+    src_dir = Path(__file__).resolve().parent
+    training_dir = src_dir.parent / "data" / "training"
+    digest = hashlib.md5()
+    for path in (
+        training_dir / "images.dvc",
+        training_dir / "masks.dvc",
+        src_dir / "prepareDataset.py",
+    ):
+        if not path.exists():
+            return None
+        digest.update(path.read_bytes())
+    return f"{digest.hexdigest()[:8]}-{seed}"
 
 
 def get_model_version():
@@ -106,162 +147,305 @@ def get_model_version():
     return f"{git_sha}-{get_data_version()}"
 
 
-# ---------------------------------------------------------------------------
-# CLI + seed
-# ---------------------------------------------------------------------------
+# Everything below runs only when executed as a script: DataLoader workers started
+# with "spawn" (Windows/macOS) re-import this module and must not re-run training
+if __name__ == "__main__":
+    # ---------------------------------------------------------------------------
+    # CLI + seed
+    # ---------------------------------------------------------------------------
+
+    parser = argparse.ArgumentParser(description="Train WaterMetersUNet")
+    parser.add_argument("--config", default="WMS/configs/train.yaml")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    random.seed(args.seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed_all(args.seed)
+
+    # Input shapes are fixed (batch_size x 3 x 512 x 512): let cuDNN autotune conv
+    # algorithms once per shape, and allow TF32 matmuls/convs on Ampere+
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cudnn.deterministic = False
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+
+    # Multi-GPU: launched with `torchrun --nproc_per_node=N WMS/src/train.py`, one process
+    # per GPU. Rank 0 does all file/MLflow I/O; plain `python train.py` runs as before.
+    distributed = "LOCAL_RANK" in os.environ
+    if distributed:
+        local_rank = int(os.environ["LOCAL_RANK"])
+        torch.cuda.set_device(local_rank)
+        dist.init_process_group("nccl")
+        device = torch.device("cuda", local_rank)
+    else:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    is_main = not distributed or dist.get_rank() == 0
 
-parser = argparse.ArgumentParser(description="Train WaterMetersUNet")
-parser.add_argument("--config", default="WMS/configs/train.yaml")
-parser.add_argument("--seed", type=int, default=42)
-args = parser.parse_args()
-
-config = load_config(args.config)
-
-torch.manual_seed(args.seed)
-np.random.seed(args.seed)
-random.seed(args.seed)
-if torch.cuda.is_available():
-    torch.cuda.manual_seed_all(args.seed)
-
-# Prepare data
-prepare_script = os.path.join(os.path.dirname(__file__), "prepareDataset.py")
-subprocess.run(
-    [sys.executable, prepare_script],
-    check=True,
-    env={**os.environ, "WMS_SEED": str(args.seed)},
-)
-
-# Load data
-baseDataDir = os.path.join(
-    os.path.dirname(os.path.abspath(__file__)), "..", "data", "training", "temp"
-)
-
-
-# Utility to gather paths
-def gather_paths(split):
-    img_dir = os.path.join(baseDataDir, split, "images")
-    mask_dir = os.path.join(baseDataDir, split, "masks")
-    images = sorted(
-        [
-            os.path.join(img_dir, f)
-            for f in os.listdir(img_dir)
-            if f.endswith((".jpg", ".png"))
-        ]
+    baseDataDir = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "data", "training", "temp"
     )
-    masks = sorted(
-        [
-            os.path.join(mask_dir, f)
-            for f in os.listdir(mask_dir)
-            if f.endswith((".jpg", ".png"))
-        ]
+
+    # Prepare data (once; the other ranks wait for the split to be written). Skipped
+    # when temp/ already holds the split for these raw data, prepareDataset.py and seed
+    if is_main:
+        marker = Path(baseDataDir) / ".prepared_version"
+        wanted = get_split_version(args.seed)
+        prepared = (
+            wanted is not None
+            and marker.exists()
+            and marker.read_text().strip() == wanted
+            and (Path(baseDataDir) / "splits.json").exists()
+            and all(
+                (Path(baseDataDir) / split / kind).is_dir()
+                for split in ("train", "val", "test")
+                for kind in ("images", "masks")
+            )
+        )
+        if prepared:
+            print(f"Dataset split up to date ({wanted}), skipping prepareDataset.py")
+        else:
+            prepare_script = os.path.join(
+                os.path.dirname(__file__), "prepareDataset.py"
+            )
+            subprocess.run(
+                [sys.executable, prepare_script],
+                check=True,
+                env={**os.environ, "WMS_SEED": str(args.seed)},
+            )
+            if wanted is not None:
+                marker.write_text(wanted)
+    if distributed:
+        dist.barrier()
+
+    # Load data: split manifest written by prepareDataset.py; fall back to listing the dirs
+    splits_manifest = os.path.join(baseDataDir, "splits.json")
+    splitPaths = {}
+    if os.path.exists(splits_manifest):
+        with open(splits_manifest) as f:
+            splitPaths = json.load(f)
+
+    def list_images(directory):
+        # scandir yields the full paths without a separate join per entry
+        with os.scandir(directory) as entries:
+            return sorted(e.path for e in entries if e.name.endswith((".jpg", ".png")))
+
+    # Utility to gather paths
+    def gather_paths(split):
+        if split in splitPaths:
+            return splitPaths[split]["images"], splitPaths[split]["masks"]
+        return (
+            list_images(os.path.join(baseDataDir, split, "images")),
+            list_images(os.path.join(baseDataDir, split, "masks")),
+        )
+
+    trainImagePaths, trainMaskPaths = gather_paths("train")
+    testImagePaths, testMaskPaths = gather_paths("test")
+    valImagePaths, valMaskPaths = gather_paths("val")
+
+    # Optionally read samples pre-resized from memory-mapped arrays (built once, reused across runs)
+    use_cache = config["data"].get("cache", False)
+
+    def split_cache(split, images, masks, preprocess=False):
+        if not use_cache:
+            return None
+        # Outside temp/{train,val,test}, which are DVC outs of the prepare stage
+        cache_dir = os.path.join(baseDataDir, "cache", split)
+        if is_main:
+            # Rebuilt when the split or the DVC-tracked data changes
+            ensure_cache(
+                images,
+                masks,
+                cache_dir,
+                version=get_data_version(),
+                preprocess=preprocess,
+                train=split == "train",
+            )
+        if distributed:
+            dist.barrier()
+        return cache_dir
+
+    # Optionally leave resize + preprocessing to GPUPreprocessor (workers only decode;
+    # for train they also do the spatial augmentation)
+    gpu_preprocess = config["data"].get("gpu_preprocess", False)
+    # ...and with it, val/test JPEGs decoded by nvJPEG on the GPU (workers only read files)
+    gpu_decode = (
+        gpu_preprocess
+        and config["data"].get("gpu_decode", False)
+        and device.type == "cuda"
     )
-    return images, masks
-
-
-trainImagePaths, trainMaskPaths = gather_paths("train")
-testImagePaths, testMaskPaths = gather_paths("test")
-valImagePaths, valMaskPaths = gather_paths("val")
-
-# Use augmented transforms for training, simple transforms for val/test
-trainTransforms = TrainTransforms(
-    p_hflip=config["augmentation"]["horizontal_flip"],
-    p_vflip=config["augmentation"]["vertical_flip"],
-    rotation_degrees=config["augmentation"]["rotation_degrees"],
-    p_rotate=config["augmentation"]["rotation_prob"],
-    p_color_jitter=config["augmentation"]["color_jitter_prob"],
-)
-trainDataset = WMSDataset(
-    trainImagePaths, trainMaskPaths, paired_transforms=trainTransforms
-)
-valDataset = WMSDataset(valImagePaths, valMaskPaths, imageTransforms=valTransforms)
-testDataset = WMSDataset(testImagePaths, testMaskPaths, imageTransforms=valTransforms)
-
-# DataLoaders
-batch_size = config["training"]["batch_size"]
-num_workers = min(4, os.cpu_count() or 1)
-trainLoader = DataLoader(
-    trainDataset,
-    batch_size=batch_size,
-    shuffle=True,
-    num_workers=num_workers,
-    pin_memory=False,
-)
-valLoader = DataLoader(
-    valDataset,
-    batch_size=batch_size,
-    shuffle=False,
-    num_workers=num_workers,
-    pin_memory=False,
-)
-testLoader = DataLoader(
-    testDataset,
-    batch_size=batch_size,
-    shuffle=False,
-    num_workers=num_workers,
-    pin_memory=False,
-)
-
-# Device
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-model = WaterMetersUNet(inChannels=3, outChannels=1).to(device)
-
-# Loss, optimizer and scheduler
-# Revert to pos_weight=1.0 after pos_weight=43 caused training instability
-pos_weight = torch.tensor([1.0], device=device)
-criterion = nn.BCEWithLogitsLoss(pos_weight=pos_weight)
-optimizer = optim.Adam(
-    model.parameters(),
-    lr=config["training"]["learning_rate"],
-    weight_decay=config["training"]["weight_decay"],
-)
-scheduler = ReduceLROnPlateau(
-    optimizer,
-    mode="min",
-    factor=config["training"]["scheduler"]["factor"],
-    patience=config["training"]["scheduler"]["patience"],
-    min_lr=config["training"]["scheduler"]["min_lr"],
-)
-
-# Tracking
-trainLosses, valLosses, testLosses = [], [], []
-trainAccs, valAccs, testAccs = [], [], []
-trainDice, valDice, testDice = [], [], []
-trainIoU, valIoU, testIoU = [], [], []
-epoch_logs = []
-numEpochs = config["training"]["epochs"]
-bestVal = float("inf")
-patienceCtr = 0
-
-# Session tracking variables
-bestSessionVal = float("inf")  # Best validation loss in current session
-bestSessionEpoch = 0  # Epoch with best result in session
-bestSessionMetrics = {}  # Metrics of best model in session
-
-# Load existing best.pth and validate it to get baseline for comparison
-models_dir = os.path.join(os.path.dirname(__file__), "..", "models")
-best_path = os.path.join(models_dir, "best.pth")
-previousBestVal = float("inf")
-
-if os.path.exists(best_path):
-    print("Found existing best.pth - validating to establish baseline...")
-    model.load_state_dict(torch.load(best_path, map_location=device))
-    model.eval()
-    runningLoss = 0.0
-    with torch.no_grad():
-        for images, masks in valLoader:
-            images, masks = images.to(device), masks.to(device)
-            outputs = model(images)
-            runningLoss += criterion(outputs, masks).item()
-    previousBestVal = runningLoss / len(valLoader)
-    print(f"Previous best.pth validation loss: {previousBestVal:.4f}")
-    print("=" * 80)
-    # Reset model for training
-    model = WaterMetersUNet(inChannels=3, outChannels=1).to(device)
+    # ...and train flips/rotation batched on the GPU too (train workers only resize)
+    gpu_augment = gpu_preprocess and config["data"].get("gpu_augment", False)
+
+    # Use augmented transforms for training, simple transforms for val/test
+    trainTransforms = TrainTransforms(
+        p_hflip=config["augmentation"]["horizontal_flip"],
+        p_vflip=config["augmentation"]["vertical_flip"],
+        rotation_degrees=config["augmentation"]["rotation_degrees"],
+        p_rotate=config["augmentation"]["rotation_prob"],
+        p_color_jitter=config["augmentation"]["color_jitter_prob"],
+        gpu_intensity=gpu_preprocess,
+        gpu_spatial=gpu_augment,
+    )
+    trainDataset = WMSDataset(
+        trainImagePaths,
+        trainMaskPaths,
+        paired_transforms=trainTransforms,
+        cache_dir=split_cache("train", trainImagePaths, trainMaskPaths),
+    )
+    valDataset = WMSDataset(
+        valImagePaths,
+        valMaskPaths,
+        imageTransforms=valTransforms,
+        raw=gpu_preprocess,
+        encoded=gpu_decode,
+        # CPU path: val/test are not augmented, so their whole valTransforms output
+        # is cached too (build_cache preprocess=True)
+        preprocessed=not gpu_preprocess,
+        cache_dir=split_cache(
+            "val", valImagePaths, valMaskPaths, preprocess=not gpu_preprocess
+        ),
+    )
+    testDataset = WMSDataset(
+        testImagePaths,
+        testMaskPaths,
+        imageTransforms=valTransforms,
+        raw=gpu_preprocess,
+        encoded=gpu_decode,
+        preprocessed=not gpu_preprocess,
+        cache_dir=split_cache(
+            "test", testImagePaths, testMaskPaths, preprocess=not gpu_preprocess
+        ),
+    )
+    eval_collate = raw_collate if gpu_preprocess else None
+
+    # DataLoaders
+    batch_size = config["training"]["batch_size"]
+    # Decode/augment in parallel worker processes, several batches queued ahead of the GPU
+    # (torchrun: the cores are shared by the ranks on this node)
+    num_workers = max(
+        1, min(8, os.cpu_count() or 1) // int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+    )
+    prefetch_factor = 4  # lower this if pinned host memory runs out
+    # Each rank trains on its own 1/world_size shard of the train set, reshuffled per epoch
+    trainSampler = (
+        DistributedSampler(trainDataset, shuffle=True, seed=args.seed)
+        if distributed
+        else None
+    )
+    # drop_last only once the train set fills a global batch (else it yields no batches)
+    world_size = dist.get_world_size() if distributed else 1
+    drop_last = len(trainDataset) >= batch_size * world_size
+    trainLoader = DataLoader(
+        trainDataset,
+        batch_size=batch_size,
+        shuffle=trainSampler is None,
+        sampler=trainSampler,
+        # Static batch shape: the CUDA graphs recorded by torch.compile
+        # (reduce-overhead) are replayed every step, never re-recorded for a short tail
+        drop_last=drop_last,
+        num_workers=num_workers,
+        prefetch_factor=prefetch_factor,
+        pin_memory=torch.cuda.is_available(),  # required for async copies in DataPrefetcher
+        persistent_workers=True,  # keep workers (and their open files) across epochs
+    )
+    valLoader = DataLoader(
+        valDataset,
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        prefetch_factor=prefetch_factor,
+        pin_memory=torch.cuda.is_available(),
+        persistent_workers=True,
+        collate_fn=eval_collate,
+    )
+    testLoader = DataLoader(
+        testDataset,
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        prefetch_factor=prefetch_factor,
+        pin_memory=torch.cuda.is_available(),
+        persistent_workers=True,
+        collate_fn=eval_collate,
+    )
+
+    gpuPreprocessor = GPUPreprocessor().to(device) if gpu_preprocess else None
+
+    # Mixed precision on CUDA: BF16 on Ampere+ (sm_80), FP16 on older GPUs (e.g. T4).
+    # Only FP16 needs its gradients scaled against underflow; BF16 has the FP32 range
+    use_amp = config["training"].get("amp", False) and device.type == "cuda"
+    amp_dtype = torch.bfloat16
+    if use_amp and torch.cuda.get_device_capability(device)[0] < 8:
+        amp_dtype = torch.float16
+    scaler = torch.amp.GradScaler(
+        "cuda", enabled=use_amp and amp_dtype == torch.float16
+    )
+
+    def autocast():
+        """Autocast context for forward passes (no-op unless AMP is enabled)."""
+        return torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=use_amp)
+
+    use_compile = (
+        config["training"].get("compile", False)
+        and device.type == "cuda"
+        and hasattr(torch, "compile")
+    )
+
+    def wrap_for_training(model):
+        """
+        Wrap the model in DDP (multi-GPU runs) and torch.compile it (if enabled).
+
+        The wrappers share parameters with `model`; keep saving model.state_dict() so
+        checkpoints don't get the "module." / "_orig_mod." key prefixes.
+        """
+        if distributed:
+            # Gradients are all-reduced in buckets, overlapped with the backward pass
+            model = DDP(model, device_ids=[device.index])
+        if use_compile:
+            model = torch.compile(model, mode="reduce-overhead")
+        return model
+
+    # NHWC on CUDA: cuDNN picks Tensor-Core friendly kernels for the 3x3 convs.
+    # Models and image batches use it; single-channel masks stay NCHW
+    memory_format = (
+        torch.channels_last if device.type == "cuda" else torch.contiguous_format
+    )
+
+    def eval_batches(loader):
+        """Yield val/test (images, masks) on device, preprocessed on the GPU if enabled."""
+        if gpu_decode:
+            loader = GPUDecodeLoader(loader, device)
+        for images, masks in DataPrefetcher(loader, device):
+            if gpuPreprocessor is not None:
+                images, masks = gpuPreprocessor(images, masks)
+            yield images.contiguous(memory_format=memory_format), masks
+
+    # Optional architecture variants (see WaterMetersUNet): depthwise-separable convs,
+    # PixelShuffle upsampling in the decoder
+    model_arch = {
+        "separable": config["model"].get("separable", False),
+        "pixel_shuffle": config["model"].get("pixel_shuffle", False),
+    }
+    model = WaterMetersUNet(inChannels=3, outChannels=1, **model_arch).to(
+        device, memory_format=memory_format
+    )
+
+    # Loss, optimizer and scheduler
+    # Revert to pos_weight=1.0 after pos_weight=43 caused training instability
+    pos_weight = torch.tensor([1.0], device=device)
+    criterion = nn.BCEWithLogitsLoss(pos_weight=pos_weight)
+    # Fused Adam on CUDA: one multi-tensor kernel per step instead of a handful of
+    # element-wise launches per parameter; GradScaler supports it directly
     optimizer = optim.Adam(
         model.parameters(),
         lr=config["training"]["learning_rate"],
         weight_decay=config["training"]["weight_decay"],
+        fused=device.type == "cuda",
     )
     scheduler = ReduceLROnPlateau(
         optimizer,
@@ -271,429 +455,529 @@ if os.path.exists(best_path):
         min_lr=config["training"]["scheduler"]["min_lr"],
     )
 
-# MLflow experiment tracking
-tracking_uri = os.environ.get("MLFLOW_TRACKING_URI")
-if tracking_uri:
-    mlflow.set_tracking_uri(tracking_uri)
-
+    # Tracking
+    trainLosses, valLosses = [], []
+    trainAccs, valAccs = [], []
+    trainDice, valDice = [], []
+    trainIoU, valIoU = [], []
+    epoch_logs = []
+    numEpochs = config["training"]["epochs"]
+    # Newest N per-epoch unet_epoch*.pth to keep; 0 = no per-epoch checkpoints
+    keepCheckpoints = config["training"].get("keep_checkpoints", 0)
+    bestVal = float("inf")
+    patienceCtr = 0
+
+    # Session tracking variables
+    bestSessionVal = float("inf")  # Best validation loss in current session
+    bestSessionEpoch = 0  # Epoch with best result in session
+    bestSessionMetrics = {}  # Metrics of best model in session
+
+    # Load existing best.pth and validate it to get baseline for comparison
+    models_dir = os.path.join(os.path.dirname(__file__), "..", "models")
+    if is_main:
+        os.makedirs(models_dir, exist_ok=True)
+
+    # Checkpoints are serialized by a background thread from a CPU snapshot of the
+    # weights, so the epoch loop doesn't wait for torch.save and the disk
+    # (a single writer keeps the saves in order)
+    checkpointWriter = ThreadPoolExecutor(max_workers=1)
+    pendingSaves = []
+
+    def write_checkpoint(state, filename, prune):
+        torch.save(state, os.path.join(models_dir, filename))
+        if prune:
+            checkpoints = sorted(
+                Path(models_dir).glob("unet_epoch*.pth"),
+                key=lambda p: p.stat().st_mtime,
+            )
+            for stale in checkpoints[:-keepCheckpoints]:
+                stale.unlink(missing_ok=True)
 
-# Inform about potential delay when connecting to remote MLflow
-if tracking_uri:
-    print("=" * 80)
-    print("🔗 Connecting to MLflow server...")
-    print(f"   MLflow URI: {tracking_uri}")
-    print("   ⏱️  Note: Initial connection from GitHub Actions may take 3-5 minutes")
-    print("   This is normal due to network routing. Please be patient.")
-    print("=" * 80)
+    def save_checkpoint(filename, prune=False):
+        state = {
+            k: v.detach().to("cpu", copy=True) for k, v in model.state_dict().items()
+        }
+        pendingSaves.append(
+            checkpointWriter.submit(write_checkpoint, state, filename, prune)
+        )
 
-mlflow.set_experiment("water-meter-segmentation")
-mlflow.start_run(run_name=get_model_version())
-mlflow.log_params(
-    {
-        "seed": args.seed,
-        "epochs": numEpochs,
-        "batch_size": config["training"]["batch_size"],
-        "learning_rate": config["training"]["learning_rate"],
-        "weight_decay": config["training"]["weight_decay"],
-        "early_stopping_patience": config["training"]["early_stopping_patience"],
-        "scheduler_factor": config["training"]["scheduler"]["factor"],
-        "scheduler_patience": config["training"]["scheduler"]["patience"],
-        "hflip": config["augmentation"]["horizontal_flip"],
-        "vflip": config["augmentation"]["vertical_flip"],
-        "rotation_degrees": config["augmentation"]["rotation_degrees"],
-        "rotation_prob": config["augmentation"]["rotation_prob"],
-        "color_jitter_prob": config["augmentation"]["color_jitter_prob"],
-    }
-)
+    best_path = os.path.join(models_dir, "best.pth")
+    previousBestVal = float("inf")
 
-# Training loop
-for epoch in range(1, numEpochs + 1):
-    model.train()
-    runningLoss, runningAcc, runningDice, runningIoU = 0.0, 0.0, 0.0, 0.0
+    if is_main and os.path.exists(best_path):
+        print("Found existing best.pth - validating to establish baseline...")
+        # mmap + weights_only: page in the plain state_dict without the generic unpickler
+        best_sd = torch.load(
+            best_path, map_location=device, mmap=True, weights_only=True
+        )
+        # best.pth may have been trained with a different architecture than the config asks for
+        baseline = WaterMetersUNet(
+            inChannels=3, outChannels=1, **arch_from_state_dict(best_sd)
+        ).to(device, memory_format=memory_format)
+        baseline.load_state_dict(best_sd)
+        baseline.eval()
+        # Separate module: the fresh training model, optimizer and scheduler stay untouched
+        runningLoss = torch.zeros((), device=device)
+        with torch.inference_mode():
+            for images, masks in eval_batches(valLoader):
+                with autocast():
+                    outputs = baseline(images)
+                    loss = criterion(outputs, masks)
+                runningLoss += loss.detach().float()
+        del baseline, best_sd
+        previousBestVal = (runningLoss / len(valLoader)).item()
+        print(f"Previous best.pth validation loss: {previousBestVal:.4f}")
+        print("=" * 80)
+
+    # DDP starts every rank from rank 0's weights
+    trainingModel = wrap_for_training(model)
+
+    # MLflow experiment tracking
+    tracking_uri = os.environ.get("MLFLOW_TRACKING_URI")
+    if tracking_uri:
+        mlflow.set_tracking_uri(tracking_uri)
+
+    # Inform about potential delay when connecting to remote MLflow
+    if is_main and tracking_uri:
+        print("=" * 80)
+        print("🔗 Connecting to MLflow server...")
+        print(f"   MLflow URI: {tracking_uri}")
+        print(
+            "   ⏱️  Note: Initial connection from GitHub Actions may take 3-5 minutes"
+        )
+        print("   This is normal due to network routing. Please be patient.")
+        print("=" * 80)
+
+    if is_main:
+        mlflow.set_experiment("water-meter-segmentation")
+        mlflow.start_run(run_name=get_model_version())
+        mlflow.log_params(
+            {
+                "seed": args.seed,
+                "epochs": numEpochs,
+                "batch_size": config["training"]["batch_size"],
+                "learning_rate": config["training"]["learning_rate"],
+                "weight_decay": config["training"]["weight_decay"],
+                "early_stopping_patience": config["training"][
+                    "early_stopping_patience"
+                ],
+                "scheduler_factor": config["training"]["scheduler"]["factor"],
+                "scheduler_patience": config["training"]["scheduler"]["patience"],
+                "hflip": config["augmentation"]["horizontal_flip"],
+                "vflip": config["augmentation"]["vertical_flip"],
+                "rotation_degrees": config["augmentation"]["rotation_degrees"],
+                "rotation_prob": config["augmentation"]["rotation_prob"],
+                "color_jitter_prob": config["augmentation"]["color_jitter_prob"],
+                "world_size": dist.get_world_size() if distributed else 1,
+            }
+        )
 
-    for images, masks in trainLoader:
-        images, masks = images.to(device), masks.to(device)
-        optimizer.zero_grad()
-        outputs = model(images)
-        loss = criterion(outputs, masks)
-        loss.backward()
-        optimizer.step()
-
-        with torch.no_grad():
-            probs = torch.sigmoid(outputs)
-            preds = (probs > 0.5).float()
-            preds_np = preds.cpu().numpy()
-            masks_np = masks.cpu().numpy()
-            batch_acc = pixel_accuracy(preds_np, masks_np)
-            batch_dice = sum(
-                [dice_coeff(p, m) for p, m in zip(preds_np, masks_np)]
-            ) / len(preds_np)
-            batch_iou = sum(
-                [iou_coeff(p, m) for p, m in zip(preds_np, masks_np)]
-            ) / len(preds_np)
-        runningAcc += batch_acc
-        runningDice += batch_dice
-        runningIoU += batch_iou
-        runningLoss += loss.item()
-
-    avgTrainLoss = runningLoss / len(trainLoader)
-    avgTrainAcc = runningAcc / len(trainLoader)
-    avgTrainDice = runningDice / len(trainLoader)
-    avgTrainIoU = runningIoU / len(trainLoader)
-    trainLosses.append(avgTrainLoss)
-    trainAccs.append(avgTrainAcc)
-    trainDice.append(avgTrainDice)
-    trainIoU.append(avgTrainIoU)
-
-    # Validation
-    model.eval()
-    runningLoss, runningValAcc, runningValDice, runningValIoU = 0.0, 0.0, 0.0, 0.0
-    with torch.no_grad():
-        for images, masks in valLoader:
-            images, masks = images.to(device), masks.to(device)
-            outputs = model(images)
-            runningLoss += criterion(outputs, masks).item()
-            probs = torch.sigmoid(outputs)
-            preds = (probs > 0.5).float()
-            preds_np = preds.cpu().numpy()
-            masks_np = masks.cpu().numpy()
-            runningValAcc += pixel_accuracy(preds_np, masks_np)
-            runningValDice += sum(
-                [dice_coeff(p, m) for p, m in zip(preds_np, masks_np)]
-            ) / len(preds_np)
-            runningValIoU += sum(
-                [iou_coeff(p, m) for p, m in zip(preds_np, masks_np)]
-            ) / len(preds_np)
-
-    avgValLoss = runningLoss / len(valLoader)
-    avgValAcc = runningValAcc / len(valLoader)
-    avgValDice = runningValDice / len(valLoader)
-    avgValIoU = runningValIoU / len(valLoader)
-    valLosses.append(avgValLoss)
-    valAccs.append(avgValAcc)
-    valDice.append(avgValDice)
-    valIoU.append(avgValIoU)
-    scheduler.step(avgValLoss)
-
-    # Testing
-    model.eval()
-    runningTestLoss, runningTestAcc, runningTestDice, runningTestIoU = (
-        0.0,
-        0.0,
-        0.0,
-        0.0,
-    )
-    with torch.no_grad():
-        for images, masks in testLoader:
-            images, masks = images.to(device), masks.to(device)
-            outputs = model(images)
-            runningTestLoss += criterion(outputs, masks).item()
-            probs = torch.sigmoid(outputs)
-            preds = (probs > 0.5).float()
-            preds_np = preds.cpu().numpy()
-            masks_np = masks.cpu().numpy()
-            runningTestAcc += pixel_accuracy(preds_np, masks_np)
-            runningTestDice += sum(
-                [dice_coeff(p, m) for p, m in zip(preds_np, masks_np)]
-            ) / len(preds_np)
-            runningTestIoU += sum(
-                [iou_coeff(p, m) for p, m in zip(preds_np, masks_np)]
-            ) / len(preds_np)
-
-    avgTestLoss = runningTestLoss / len(testLoader)
-    avgTestAcc = runningTestAcc / len(testLoader)
-    avgTestDice = runningTestDice / len(testLoader)
-    avgTestIoU = runningTestIoU / len(testLoader)
-    testLosses.append(avgTestLoss)
-    testAccs.append(avgTestAcc)
-    testDice.append(avgTestDice)
-    testIoU.append(avgTestIoU)
-
-    # Logging
-    epoch_line = (
-        f"Epoch {epoch}/{numEpochs}"
-        f" - Train Loss: {avgTrainLoss:.4f}, Acc: {avgTrainAcc:.4f}, Dice: {avgTrainDice:.4f}, IoU: {avgTrainIoU:.4f}"
-        f" - Val Loss: {avgValLoss:.4f}, Acc: {avgValAcc:.4f}, Dice: {avgValDice:.4f}, IoU: {avgValIoU:.4f}"
-        f" - Test Loss: {avgTestLoss:.4f}, Acc: {avgTestAcc:.4f}, Dice: {avgTestDice:.4f}, IoU: {avgTestIoU:.4f}"
-    )
-    print(epoch_line)
-    epoch_logs.append(epoch_line)
+    # Per-epoch metrics are buffered and sent in one log_batch request every few
+    # epochs, instead of one HTTP round-trip per metric call
+    pendingMetrics = []
 
-    # Log to MLflow every 5 epochs or on last epoch to reduce server load
-    if epoch % 5 == 0 or epoch == numEpochs:
+    def flush_metrics(epoch):
+        if not pendingMetrics:
+            return
         try:
-            mlflow.log_metrics(
-                {
+            MlflowClient().log_batch(
+                mlflow.active_run().info.run_id, metrics=pendingMetrics
+            )
+        except Exception as e:
+            print(f"⚠️  MLflow unavailable at epoch {epoch}: {e}")
+            print("→ Continuing training locally")
+        pendingMetrics.clear()
+
+    # Training loop
+    for epoch in range(1, numEpochs + 1):
+        model.train()
+        if trainSampler is not None:
+            trainSampler.set_epoch(epoch)
+        # Summed on the GPU, copied to the host once per epoch
+        runningTrain = torch.zeros(4, device=device)
+
+        # Next batch is copied to the GPU on a side stream while this one trains
+        for images, masks in DataPrefetcher(trainLoader, device):
+            if gpuPreprocessor is not None:
+                if gpu_augment:
+                    images, masks = trainTransforms.spatial_batch(images, masks)
+                images = gpuPreprocessor(images, resized=True)
+                images = trainTransforms.color_jitter_batch(images)
+            images = images.contiguous(memory_format=memory_format)
+            optimizer.zero_grad(set_to_none=True)
+            with autocast():
+                outputs = trainingModel(images)
+                loss = criterion(outputs, masks)
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+
+            with torch.inference_mode():
+                runningTrain += batch_metrics(loss, outputs, masks)
+
+        if distributed:
+            # Average the per-shard train metrics over all ranks
+            dist.all_reduce(runningTrain)
+            runningTrain /= dist.get_world_size()
+        runningLoss, runningAcc, runningDice, runningIoU = runningTrain.tolist()
+        avgTrainLoss = runningLoss / len(trainLoader)
+        avgTrainAcc = runningAcc / len(trainLoader)
+        avgTrainDice = runningDice / len(trainLoader)
+        avgTrainIoU = runningIoU / len(trainLoader)
+        trainLosses.append(avgTrainLoss)
+        trainAccs.append(avgTrainAcc)
+        trainDice.append(avgTrainDice)
+        trainIoU.append(avgTrainIoU)
+
+        # Validation
+        model.eval()
+        runningVal = torch.zeros(4, device=device)
+        with torch.inference_mode():
+            for images, masks in eval_batches(valLoader):
+                with autocast():
+                    outputs = trainingModel(images)
+                    loss = criterion(outputs, masks)
+                runningVal += batch_metrics(loss, outputs, masks)
+        runningLoss, runningValAcc, runningValDice, runningValIoU = runningVal.tolist()
+
+        avgValLoss = runningLoss / len(valLoader)
+        if distributed:
+            # Every rank evaluates the full val set; use rank 0's loss so LR scheduling
+            # and early stopping can't diverge between ranks
+            valLossTensor = torch.tensor([avgValLoss], device=device)
+            dist.broadcast(valLossTensor, src=0)
+            avgValLoss = valLossTensor.item()
+        avgValAcc = runningValAcc / len(valLoader)
+        avgValDice = runningValDice / len(valLoader)
+        avgValIoU = runningValIoU / len(valLoader)
+        valLosses.append(avgValLoss)
+        valAccs.append(avgValAcc)
+        valDice.append(avgValDice)
+        valIoU.append(avgValIoU)
+        scheduler.step(avgValLoss)
+
+        # Logging
+        epoch_line = (
+            f"Epoch {epoch}/{numEpochs}"
+            f" - Train Loss: {avgTrainLoss:.4f}, Acc: {avgTrainAcc:.4f},"
+            f" Dice: {avgTrainDice:.4f}, IoU: {avgTrainIoU:.4f}"
+            f" - Val Loss: {avgValLoss:.4f}, Acc: {avgValAcc:.4f},"
+            f" Dice: {avgValDice:.4f}, IoU: {avgValIoU:.4f}"
+        )
+        if is_main:
+            print(epoch_line)
+        epoch_logs.append(epoch_line)
+
+        # Record every epoch, send to MLflow every 5 epochs to reduce server load
+        if is_main:
+            now_ms = int(time.time() * 1000)
+            pendingMetrics.extend(
+                Metric(key=key, value=value, timestamp=now_ms, step=epoch)
+                for key, value in {
                     "train_loss": avgTrainLoss,
                     "train_dice": avgTrainDice,
                     "train_iou": avgTrainIoU,
                     "val_loss": avgValLoss,
                     "val_dice": avgValDice,
                     "val_iou": avgValIoU,
-                    "test_loss": avgTestLoss,
-                    "test_dice": avgTestDice,
-                    "test_iou": avgTestIoU,
-                },
-                step=epoch,
+                }.items()
             )
-        except Exception as e:
-            print(f"⚠️  MLflow unavailable at epoch {epoch}: {e}")
-            print("→ Continuing training locally")
-
-    # Save best result for current session (after all metrics are calculated)
-    if avgValLoss < bestSessionVal:
-        bestSessionVal = avgValLoss
-        bestSessionEpoch = epoch
-        bestSessionMetrics = {
-            "epoch": epoch,
-            "val_loss": avgValLoss,
-            "val_acc": avgValAcc,
-            "val_dice": avgValDice,
-            "val_iou": avgValIoU,
-            "test_loss": avgTestLoss,
-            "test_acc": avgTestAcc,
-            "test_dice": avgTestDice,
-            "test_iou": avgTestIoU,
-        }
-        patienceCtr = 0
-        torch.save(
-            model.state_dict(),
-            os.path.join(
-                os.path.dirname(__file__), "..", "models", "best-current-session.pth"
-            ),
-        )
-        print(
-            f"  → Saved best-current-session.pth (epoch {epoch}, val_loss: {avgValLoss:.4f})"
-        )
-    else:
-        patienceCtr += 1
-        if patienceCtr >= config["training"]["early_stopping_patience"]:
-            print("Early stopping")
-            break
-
-    # Saving checkpoint
-    os.makedirs(os.path.join(os.path.dirname(__file__), "..", "models"), exist_ok=True)
-    torch.save(
-        model.state_dict(),
-        os.path.join(
-            os.path.dirname(__file__), "..", "models", f"unet_epoch{epoch}.pth"
-        ),
+            if epoch % 5 == 0:
+                flush_metrics(epoch)
+
+        # Save best result for current session (after all metrics are calculated)
+        if avgValLoss < bestSessionVal:
+            bestSessionVal = avgValLoss
+            bestSessionEpoch = epoch
+            bestSessionMetrics = {
+                "epoch": epoch,
+                "val_loss": avgValLoss,
+                "val_acc": avgValAcc,
+                "val_dice": avgValDice,
+                "val_iou": avgValIoU,
+            }
+            patienceCtr = 0
+            if is_main:
+                save_checkpoint("best-current-session.pth")
+                print(
+                    f"  → Saved best-current-session.pth (epoch {epoch}, val_loss: {avgValLoss:.4f})"
+                )
+        else:
+            patienceCtr += 1
+            if patienceCtr >= config["training"]["early_stopping_patience"]:
+                if is_main:
+                    print("Early stopping")
+                break
+
+        # Rolling per-epoch checkpoint (only the newest keepCheckpoints are kept)
+        if is_main and keepCheckpoints > 0:
+            save_checkpoint(f"unet_epoch{epoch}.pth", prune=True)
+
+    # Whatever is still buffered (last epochs, early stopping)
+    if is_main:
+        flush_metrics(epoch)
+    # best-current-session.pth is read below: wait until every checkpoint is written
+    for save in pendingSaves:
+        save.result()
+    checkpointWriter.shutdown()
+
+    # Everything below (best.pth update, logs, plots, final eval, registry) is rank 0 only
+    if distributed:
+        dist.destroy_process_group()
+        if not is_main:
+            sys.exit(0)
+
+    # Training completed - compare with previous best and update if better
+    print("\n" + "=" * 80)
+    print("Training completed!")
+    print(
+        f"Best model from this session: epoch {bestSessionEpoch}, val_loss: {bestSessionVal:.4f}"
     )
+    print("=" * 80)
 
-# Training completed - compare with previous best and update if better
-print("\n" + "=" * 80)
-print("Training completed!")
-print(
-    f"Best model from this session: epoch {bestSessionEpoch}, val_loss: {bestSessionVal:.4f}"
-)
-print("=" * 80)
+    best_session_path = os.path.join(models_dir, "best-current-session.pth")
 
-best_session_path = os.path.join(models_dir, "best-current-session.pth")
+    # Compare with previous best.pth
+    print(f"\nPrevious best validation loss: {previousBestVal:.4f}")
+    print(f"Current session best validation loss: {bestSessionVal:.4f}")
 
-# Compare with previous best.pth
-print(f"\nPrevious best validation loss: {previousBestVal:.4f}")
-print(f"Current session best validation loss: {bestSessionVal:.4f}")
+    results_dir = os.path.join(os.path.dirname(__file__), "..", "Results")
+    os.makedirs(results_dir, exist_ok=True)
 
-results_dir = os.path.join(os.path.dirname(__file__), "..", "Results")
-os.makedirs(results_dir, exist_ok=True)
+    if bestSessionVal < previousBestVal:
+        import shutil
 
-if bestSessionVal < previousBestVal:
-    import shutil
+        shutil.copy(best_session_path, best_path)
+        print(f"✓ Updated best.pth with model from epoch {bestSessionEpoch}")
+        improved = True
+    else:
+        print(
+            f"✗ Current session did not improve best.pth (difference: {bestSessionVal - previousBestVal:+.4f})"
+        )
+        print(f"  best-current-session.pth saved for reference")
+        improved = False
+
+    # Load best.pth for final evaluation
+    print("\n" + "=" * 80)
+    print("Loading best.pth for final evaluation...")
+    best_sd = torch.load(best_path, map_location=device, mmap=True, weights_only=True)
+    model = WaterMetersUNet(
+        inChannels=3, outChannels=1, **arch_from_state_dict(best_sd)
+    ).to(device, memory_format=memory_format)
+    model.load_state_dict(best_sd)
+    print("=" * 80)
 
-    shutil.copy(best_session_path, best_path)
-    print(f"✓ Updated best.pth with model from epoch {bestSessionEpoch}")
-    improved = True
-else:
-    print(
-        f"✗ Current session did not improve best.pth (difference: {bestSessionVal - previousBestVal:+.4f})"
-    )
-    print(f"  best-current-session.pth saved for reference")
-    improved = False
-
-# Always write Terminal.log (every session, regardless of improvement)
-from datetime import datetime
-
-log_path = os.path.join(results_dir, "Terminal.log")
-timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-log_lines = [
-    "",
-    "=" * 80,
-    f"Training Session - {timestamp}",
-    "=" * 80,
-    f"Status: {'IMPROVED — best.pth updated' if improved else 'NOT IMPROVED'}",
-    f"Previous best val_loss: {previousBestVal:.4f}",
-    f"Session best  val_loss: {bestSessionVal:.4f}",
-    "",
-    "Configuration:",
-    f"  - Epochs: {numEpochs}",
-    f"  - Early stopping patience: {config['training']['early_stopping_patience']}",
-    f"  - Learning rate: {config['training']['learning_rate']}",
-    f"  - Batch size: {config['training']['batch_size']}",
-    f"  - Seed: {args.seed}",
-    "",
-    "--- Per-epoch metrics ---",
-    *epoch_logs,
-    "",
-    f"Best Model (epoch {bestSessionEpoch}):",
-    "  Validation Metrics:",
-    f"    - Loss: {bestSessionMetrics['val_loss']:.4f}",
-    f"    - Accuracy: {bestSessionMetrics['val_acc']:.4f}",
-    f"    - Dice: {bestSessionMetrics['val_dice']:.4f}",
-    f"    - IoU: {bestSessionMetrics['val_iou']:.4f}",
-    "",
-    "  Test Metrics:",
-    f"    - Loss: {bestSessionMetrics['test_loss']:.4f}",
-    f"    - Accuracy: {bestSessionMetrics['test_acc']:.4f}",
-    f"    - Dice: {bestSessionMetrics['test_dice']:.4f}",
-    f"    - IoU: {bestSessionMetrics['test_iou']:.4f}",
-    "",
-    "Models saved:",
-    f"  - best-current-session.pth (this session)",
-    f"  - unet_epoch1.pth to unet_epoch{epoch}.pth",
-    "=" * 80,
-    "",
-]
-
-with open(log_path, "w", encoding="utf-8") as f:
-    f.write("\n".join(log_lines))
-
-print(f"  → Terminal.log written")
-
-# Try to upload log to MLflow (gracefully handle S3 permission errors)
-try:
-    mlflow.log_artifact(log_path, artifact_path="logs")
-    print(f"  → Terminal.log uploaded to MLflow")
-except Exception as e:
-    print(f"  ⚠️  Warning: Could not upload Terminal.log to MLflow: {e}")
-    print(
-        f"  → Training succeeded, but artifact upload failed (AWS Academy restriction)"
+    # Final metrics on test set (the only pass over testLoader; it plays no part in model selection)
+    print("--- Final evaluation on test set ---")
+    dice_scores, iou_scores, hausdorff_dists = [], [], []
+    runningTest = torch.zeros(4, device=device)
+    model.eval()
+    with torch.inference_mode():
+        for images, masks in eval_batches(testLoader):
+            with autocast():
+                outputs = model(images)
+                loss = criterion(outputs, masks)
+            runningTest += batch_metrics(loss, outputs, masks)
+            preds = (outputs > 0).float()
+            dice_scores.append(dice_coeff_batch(preds, masks, reduce=False))
+            iou_scores.append(iou_coeff_batch(preds, masks, reduce=False))
+            for p, m in zip(preds, masks):
+                hausdorff_dists.append(safe_hausdorff(p, m))
+    dice_scores = torch.cat(dice_scores).tolist()
+    iou_scores = torch.cat(iou_scores).tolist()
+
+    testLoss, testAcc = (runningTest[:2] / len(testLoader)).tolist()
+    finalTest = {
+        "loss": testLoss,
+        "acc": testAcc,
+        "dice": float(np.mean(dice_scores)),
+        "iou": float(np.mean(iou_scores)),
+    }
+
+    print(f"Test Loss:      {testLoss:.4f}")
+    print(f"Test Accuracy:  {testAcc:.4f}")
+    print(f"Test Dice:      {np.mean(dice_scores):.4f}")
+    print(f"Test IoU:       {np.mean(iou_scores):.4f}")
+    print(f"Test Hausdorff: {np.mean(hausdorff_dists):.4f}")
+
+    # Log final test metrics to MLflow (summary metrics without step)
+    # These are the metrics from best.pth evaluated on full test set
+    try:
+        mlflow.log_metric("final_test_loss", testLoss)
+        mlflow.log_metric("final_test_acc", testAcc)
+        mlflow.log_metric("final_test_dice", float(np.mean(dice_scores)))
+        mlflow.log_metric("final_test_iou", float(np.mean(iou_scores)))
+        mlflow.log_metric("final_test_hausdorff", float(np.mean(hausdorff_dists)))
+    except Exception as e:
+        print(f"⚠️  MLflow final metrics upload failed: {e}")
+        print("→ Metrics saved locally in metrics.json")
+
+    # Always write Terminal.log (every session, regardless of improvement)
+    from datetime import datetime
+
+    log_path = os.path.join(results_dir, "Terminal.log")
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    epoch_checkpoints = (
+        [
+            f"  - last {keepCheckpoints} unet_epoch*.pth checkpoints (up to epoch {epoch})"
+        ]
+        if keepCheckpoints > 0
+        else []
     )
-    # Continue - training completed successfully, log is saved locally
-
-# Summary and plots
-summary(model, input_size=(3, 512, 512))
-
-metrics = [
-    ("loss", "Loss", trainLosses, valLosses, testLosses),
-    ("accuracy", "Accuracy", trainAccs, valAccs, testAccs),
-    ("dice", "Dice Coefficient", trainDice, valDice, testDice),
-    ("iou", "IoU", trainIoU, valIoU, testIoU),
-]
-
-for fname, ylabel, train_data, val_data, test_data in metrics:
-    plt.figure(figsize=(8, 5))
-    plt.plot(train_data, label="Train", color="tab:blue", marker="o", markersize=3)
-    plt.plot(val_data, label="Val", color="tab:orange", marker="s", markersize=3)
-    plt.plot(test_data, label="Test", color="tab:green", marker="^", markersize=3)
-    plt.xlabel("Epoch")
-    plt.ylabel(ylabel)
-    plt.title(f"{ylabel} vs Epoch")
-    plt.legend(loc="best")
-    plt.grid(True, alpha=0.3)
-    plt.tight_layout()
-    plt.savefig(os.path.join(results_dir, f"plot_{fname}.png"))
-    print(f"  → Saved plot_{fname}.png")
-    plt.show()
-
-# Load best.pth for final evaluation
-print("\n" + "=" * 80)
-print("Loading best.pth for final evaluation...")
-model.load_state_dict(torch.load(best_path, map_location=device))
-print("=" * 80)
-
-# Final metrics on test set
-print("--- Final evaluation on test set ---")
-dice_scores, iou_scores, hausdorff_dists = [], [], []
-model.eval()
-with torch.no_grad():
-    for images, masks in testLoader:
-        images, masks = images.to(device), masks.to(device)
+    log_lines = [
+        "",
+        "=" * 80,
+        f"Training Session - {timestamp}",
+        "=" * 80,
+        f"Status: {'IMPROVED — best.pth updated' if improved else 'NOT IMPROVED'}",
+        f"Previous best val_loss: {previousBestVal:.4f}",
+        f"Session best  val_loss: {bestSessionVal:.4f}",
+        "",
+        "Configuration:",
+        f"  - Epochs: {numEpochs}",
+        f"  - Early stopping patience: {config['training']['early_stopping_patience']}",
+        f"  - Learning rate: {config['training']['learning_rate']}",
+        f"  - Batch size: {config['training']['batch_size']}",
+        f"  - Seed: {args.seed}",
+        "",
+        "--- Per-epoch metrics ---",
+        *epoch_logs,
+        "",
+        f"Best Model (epoch {bestSessionEpoch}):",
+        "  Validation Metrics:",
+        f"    - Loss: {bestSessionMetrics['val_loss']:.4f}",
+        f"    - Accuracy: {bestSessionMetrics['val_acc']:.4f}",
+        f"    - Dice: {bestSessionMetrics['val_dice']:.4f}",
+        f"    - IoU: {bestSessionMetrics['val_iou']:.4f}",
+        "",
+        "Test Metrics (best.pth):",
+        f"  - Loss: {finalTest['loss']:.4f}",
+        f"  - Accuracy: {finalTest['acc']:.4f}",
+        f"  - Dice: {finalTest['dice']:.4f}",
+        f"  - IoU: {finalTest['iou']:.4f}",
+        f"  - Hausdorff: {np.mean(hausdorff_dists):.4f}",
+        "",
+        "Models saved:",
+        f"  - best-current-session.pth (this session)",
+        *epoch_checkpoints,
+        "=" * 80,
+        "",
+    ]
+
+    with open(log_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(log_lines))
+
+    print(f"  → Terminal.log written")
+
+    # Try to upload log to MLflow (gracefully handle S3 permission errors)
+    try:
+        mlflow.log_artifact(log_path, artifact_path="logs")
+        print(f"  → Terminal.log uploaded to MLflow")
+    except Exception as e:
+        print(f"  ⚠️  Warning: Could not upload Terminal.log to MLflow: {e}")
+        print(
+            f"  → Training succeeded, but artifact upload failed (AWS Academy restriction)"
+        )
+        # Continue - training completed successfully, log is saved locally
+
+    # Summary and plots
+    summary(model, input_size=(3, 512, 512))
+
+    metrics = [
+        ("loss", "Loss", trainLosses, valLosses, finalTest["loss"]),
+        ("accuracy", "Accuracy", trainAccs, valAccs, finalTest["acc"]),
+        ("dice", "Dice Coefficient", trainDice, valDice, finalTest["dice"]),
+        ("iou", "IoU", trainIoU, valIoU, finalTest["iou"]),
+    ]
+
+    for fname, ylabel, train_data, val_data, test_value in metrics:
+        plt.figure(figsize=(8, 5))
+        plt.plot(train_data, label="Train", color="tab:blue", marker="o", markersize=3)
+        plt.plot(val_data, label="Val", color="tab:orange", marker="s", markersize=3)
+        plt.axhline(
+            test_value, label="Test (best.pth)", color="tab:green", linestyle="--"
+        )
+        plt.xlabel("Epoch")
+        plt.ylabel(ylabel)
+        plt.title(f"{ylabel} vs Epoch")
+        plt.legend(loc="best")
+        plt.grid(True, alpha=0.3)
+        plt.tight_layout()
+        plt.savefig(os.path.join(results_dir, f"plot_{fname}.png"))
+        print(f"  → Saved plot_{fname}.png")
+        plt.close()  # Agg backend: show() is a no-op, close() frees the figure
+
+    model.eval()
+    images, masks = next(eval_batches(testLoader))
+    with torch.inference_mode():
         outputs = model(images)
-        probs = torch.sigmoid(outputs)
-        preds = (probs > 0.5).float().cpu().numpy()
-        masks_np = masks.cpu().numpy()
-        for p, m in zip(preds, masks_np):
-            dice_scores.append(dice_coeff(p, m))
-            iou_scores.append(iou_coeff(p, m))
-            hausdorff_dists.append(safe_hausdorff(p, m))
-
-print(f"Test Dice:      {np.mean(dice_scores):.4f}")
-print(f"Test IoU:       {np.mean(iou_scores):.4f}")
-print(f"Test Hausdorff: {np.mean(hausdorff_dists):.4f}")
-
-# Log final test metrics to MLflow (summary metrics without step)
-# These are the metrics from best.pth evaluated on full test set
-try:
-    mlflow.log_metric("final_test_dice", float(np.mean(dice_scores)))
-    mlflow.log_metric("final_test_iou", float(np.mean(iou_scores)))
-    mlflow.log_metric("final_test_hausdorff", float(np.mean(hausdorff_dists)))
-except Exception as e:
-    print(f"⚠️  MLflow final metrics upload failed: {e}")
-    print("→ Metrics saved locally in metrics.json")
-
-
-model.eval()
-images, masks = next(iter(testLoader))
-images = images.to(device)
-with torch.no_grad():
-    outputs = model(images)
-    probs = torch.sigmoid(outputs)
-    preds = (probs > 0.5).float().cpu()
-
-images = images.cpu().permute(0, 2, 3, 1).numpy()
-masks = masks.cpu().squeeze(1).numpy()
-preds = preds.squeeze(1).numpy()
-
-for i in range(images.shape[0]):
-    plt.figure(figsize=(12, 4))
-    plt.subplot(1, 3, 1)
-    plt.imshow(images[i])
-    plt.title("Image")
-    plt.axis("off")
-    plt.subplot(1, 3, 2)
-    plt.imshow(masks[i], cmap="gray")
-    plt.title("GT Mask")
-    plt.axis("off")
-    plt.subplot(1, 3, 3)
-    plt.imshow(preds[i], cmap="gray")
-    plt.title("Predicted Mask")
-    plt.axis("off")
-    plt.tight_layout()
-    plt.savefig(os.path.join(results_dir, f"plot_pred_{i}.png"))
-    print(f"  → Saved plot_pred_{i}.png")
-    plt.show()
-
-# Write metrics.json (DVC metrics output; train-with-retry.py reads this)
-metrics_out = {
-    "val_dice": float(bestSessionMetrics.get("val_dice", 0.0)),
-    "val_iou": float(bestSessionMetrics.get("val_iou", 0.0)),
-    "test_dice": float(np.mean(dice_scores)),
-    "test_iou": float(np.mean(iou_scores)),
-    "test_hausdorff": float(np.mean(hausdorff_dists)),
-}
-with open(os.path.join(models_dir, "metrics.json"), "w") as f:
-    json.dump(metrics_out, f, indent=2)
-print("  → Saved metrics.json")
-
-# Log plots to MLflow (optional — training continues if this fails)
-try:
-    for png in sorted(Path(results_dir).glob("*.png")):
-        mlflow.log_artifact(str(png), artifact_path="plots")
-    print("  → Plots uploaded to MLflow")
-except Exception as e:
-    print(f"⚠️  MLflow plot upload failed: {e}")
-    print("→ Continuing without plot artifacts")
-
-# Register model to MLflow (REQUIRED — quality gate depends on this)
-try:
-    mlflow.pytorch.log_model(
-        model, name="model", registered_model_name="water-meter-segmentation"
-    )
-    print("  → Model registered to MLflow")
-except Exception as e:
-    print(f"❌ MLflow model registration failed: {e}")
-    sys.exit(1)
+        preds = (outputs > 0).float().cpu()
+
+    images = images.cpu().permute(0, 2, 3, 1).numpy()
+    masks = masks.cpu().squeeze(1).numpy()
+    preds = preds.squeeze(1).numpy()
 
-mlflow.end_run()
-print("  → MLflow run finished")
+    # One row per sample of the batch, saved as a single PNG
+    fig, axes = plt.subplots(
+        images.shape[0], 3, figsize=(12, 4 * images.shape[0]), squeeze=False
+    )
+    for i, row in enumerate(axes):
+        for ax, data, title, cmap in zip(
+            row,
+            (images[i], masks[i], preds[i]),
+            ("Image", "GT Mask", "Predicted Mask"),
+            (None, "gray", "gray"),
+        ):
+            ax.imshow(data, cmap=cmap)
+            ax.set_title(title)
+            ax.axis("off")
+    fig.tight_layout()
+    fig.savefig(os.path.join(results_dir, "plot_preds.png"))
+    print("  → Saved plot_preds.png")
+    plt.close(fig)
+
+    # Write metrics.json (DVC metrics output; train-with-retry.py reads this)
+    metrics_out = {
+        "val_dice": float(bestSessionMetrics.get("val_dice", 0.0)),
+        "val_iou": float(bestSessionMetrics.get("val_iou", 0.0)),
+        "test_dice": float(np.mean(dice_scores)),
+        "test_iou": float(np.mean(iou_scores)),
+        "test_hausdorff": float(np.mean(hausdorff_dists)),
+    }
+    with open(os.path.join(models_dir, "metrics.json"), "w") as f:
+        json.dump(metrics_out, f, indent=2)
+    print("  → Saved metrics.json")
+
+    # Log plots to MLflow (optional — training continues if this fails). Uploaded in
+    # parallel in the background, by run id (the fluent API's active run is
+    # per-thread), while the model is serialized and registered below
+    run_id = mlflow.active_run().info.run_id
+    client = MlflowClient()
+    uploadPool = ThreadPoolExecutor(max_workers=4)
+    plotUploads = [
+        uploadPool.submit(client.log_artifact, run_id, str(png), "plots")
+        for png in sorted(Path(results_dir).glob("*.png"))
+    ]
+
+    # Register model to MLflow (REQUIRED — quality gate depends on this)
+    try:
+        mlflow.pytorch.log_model(
+            model, name="model", registered_model_name="water-meter-segmentation"
+        )
+        print("  → Model registered to MLflow")
+    except Exception as e:
+        print(f"❌ MLflow model registration failed: {e}")
+        sys.exit(1)
+
+    try:
+        for upload in plotUploads:
+            upload.result()
+        print("  → Plots uploaded to MLflow")
+    except Exception as e:
+        print(f"⚠️  MLflow plot upload failed: {e}")
+        print("→ Continuing without plot artifacts")
+    uploadPool.shutdown()
+
+    mlflow.end_run()
+    print("  → MLflow run finished")
@@ -1,16 +1,22 @@
-import torchvision.transforms as TRANS
 import torchvision.transforms.functional as TF
 import numpy as np
 import cv2
+from PIL import Image
 import torch
+import torch.nn as nn
+import torch.nn.functional as F
 import random
 
 
 def to_float_np(img):
-    arr = np.array(img).astype(np.float32) / 255.0
+    arr = np.asarray(img, dtype=np.float32) / 255.0
     return arr
 
 
+def to_chw_tensor(arr: np.ndarray):
+    return torch.from_numpy(arr).permute(2, 0, 1)  # HWC -> CHW
+
+
 def contrast_stretch(img: np.ndarray):
     p2, p98 = np.percentile(img, (2, 98))
     img = (img - p2) / (p98 - p2 + 1e-6)
@@ -23,22 +29,168 @@ def median_blur(img: np.ndarray):
     return blurred.astype(np.float32) / 255.0
 
 
-# Validation/Test transforms (no augmentation)
-valTransforms = TRANS.Compose(
-    [
-        TRANS.ToPILImage(),
-        TRANS.Resize((512, 512)),
-        TRANS.Lambda(to_float_np),
-        TRANS.Lambda(contrast_stretch),
-        TRANS.Lambda(median_blur),
-        TRANS.Lambda(lambda arr: torch.from_numpy(arr).permute(2, 0, 1)),  # HWC -> CHW
-    ]
-)
+# Mask resize of TrainTransforms (and of the train split in build_cache.py):
+# NEAREST_EXACT samples pixel centres like PIL's NEAREST
+TRAIN_MASK_INTERPOLATION = cv2.INTER_NEAREST_EXACT
+
+# The 256 possible values of to_float_np() on a uint8 image
+_U8_LEVELS = np.arange(256, dtype=np.float32) / 255.0
+
+
+def u8_percentiles(u8: np.ndarray, q=(0.02, 0.98)):
+    """
+    np.percentile(to_float_np(u8), q * 100) for a uint8 array, from a 256-bin histogram.
+
+    Same linear interpolation as numpy (bit-identical result) but O(N) instead of
+    partitioning a float copy of the whole image.
+    """
+    cum = np.cumsum(np.bincount(u8.ravel(), minlength=256))
+    idx = np.asarray(q) * (u8.size - 1)
+    k = np.floor(idx).astype(np.int64)
+    lo = _U8_LEVELS[np.searchsorted(cum, k, side="right")]
+    hi = _U8_LEVELS[np.searchsorted(cum, np.minimum(k + 1, u8.size - 1), side="right")]
+    t = idx - k
+    d = hi - lo
+    return np.where(t >= 0.5, hi - d * (1 - t), lo + d * t)
+
+
+def stretch_lut(u8: np.ndarray):
+    """contrast_stretch followed by median_blur's uint8 quantisation, as a 256-entry table."""
+    p2, p98 = u8_percentiles(u8)
+    lut = np.clip((_U8_LEVELS - p2) / (p98 - p2 + 1e-6), 0.0, 1.0)
+    return (lut * 255).astype(np.uint8)
+
+
+def stretch_and_blur(img, brightness=None, chw=False):
+    """
+    to_float_np -> contrast_stretch -> median_blur (-> brightness jitter) for a uint8
+    HWC image, bit-identical to running the steps one after another.
+
+    The stretch and jitter are monotonic per-pixel maps, so they commute with the
+    median: the 3x3 median runs on the raw uint8 image and everything else is a
+    256-entry lookup table applied with cv2.LUT, with no full-size float
+    intermediates. With chw=True the result is a contiguous (C, H, W) array: the
+    transpose is done on the uint8 median output, before the LUT, so the float32
+    image never needs a strided copy.
+    """
+    u8 = np.asarray(img, dtype=np.uint8)
+    lut = stretch_lut(u8).astype(np.float32) / 255.0
+    if brightness is not None:
+        lut = np.clip(lut * brightness, 0.0, 1.0)
+    blurred = cv2.medianBlur(u8, 3)
+    if not chw:
+        return cv2.LUT(blurred, lut)
+    blurred = np.ascontiguousarray(blurred.transpose(2, 0, 1))
+    c, h, w = blurred.shape
+    # 2-D single-channel view: cv2 would read a 3-D array as HxW with C=w channels
+    return cv2.LUT(blurred.reshape(c * h, w), lut).reshape(c, h, w)
+
+
+def stretch_and_blur_u8(img):
+    """stretch_and_blur(img) * 255 as uint8 (exact: every output is a k / 255 level)."""
+    u8 = np.asarray(img, dtype=np.uint8)
+    return cv2.LUT(cv2.medianBlur(u8, 3), stretch_lut(u8))
+
+
+def valResizedTransforms(img):
+    """Steps of valTransforms after the resize, for a 512x512 uint8 RGB image."""
+    return torch.from_numpy(stretch_and_blur(img, chw=True))
+
+
+def valTransforms(img):
+    """
+    Validation/Test transforms (no augmentation): uint8 HWC RGB array of any size ->
+    float32 (3, 512, 512) tensor.
+
+    Same steps as the former Compose of ToPILImage, Resize((512, 512)) and the
+    numpy Lambdas, as plain calls. The PIL bilinear resize is skipped for images
+    that are already 512x512, since resizing to the same size is a copy.
+    """
+    if img.shape[:2] != (512, 512):
+        img = Image.fromarray(np.ascontiguousarray(img))
+        img = np.asarray(img.resize((512, 512), Image.BILINEAR))
+    return valResizedTransforms(img)
+
+
+class GPUPreprocessor(nn.Module):
+    """
+    Batched GPU equivalent of valTransforms for samples from WMSDataset(raw=True).
+
+    Takes lists of uint8 CHW images and uint8 1xHxW 0/1 masks of any size (see
+    dataset.raw_collate), already on the target device, and returns float32
+    (N, 3, 512, 512) images and (N, 1, 512, 512) masks:
+    resize -> [0, 1] -> contrast stretch (2-98 percentile) -> 3x3 median blur.
+    Called without masks (inference) it returns the images only.
+
+    With resized=True the images are a stacked uint8 (N, 3, 512, 512) batch that is
+    already at the target size (TrainTransforms(gpu_intensity=True)); only the
+    [0, 1] scaling, contrast stretch and median blur are applied.
+    """
+
+    def __init__(self, size=(512, 512)):
+        super().__init__()
+        self.size = tuple(size)
+        self.register_buffer(
+            "percentiles", torch.tensor([0.02, 0.98]), persistent=False
+        )
+
+    @staticmethod
+    def _interpolate(tensors, size, **kwargs):
+        # One kernel for the whole batch when all samples share a shape (the usual case)
+        if isinstance(tensors, torch.Tensor) or all(
+            t.shape == tensors[0].shape for t in tensors
+        ):
+            return F.interpolate(
+                torch.stack(list(tensors)).float(), size=size, **kwargs
+            )
+        return torch.cat(
+            [F.interpolate(t[None].float(), size=size, **kwargs) for t in tensors]
+        )
+
+    def resize(self, images, masks=None):
+        # Antialiased bilinear matches PIL Resize; round to uint8 levels like PIL does
+        images = self._interpolate(
+            images, self.size, mode="bilinear", align_corners=False, antialias=True
+        )
+        images = images.round_().clamp_(0, 255).div_(255.0)
+        if masks is not None:
+            masks = self._interpolate(masks, self.size, mode="nearest")
+        return images, masks
+
+    def contrast_stretch(self, images):
+        lo, hi = torch.quantile(images.flatten(1), self.percentiles.to(images), dim=1)
+        lo, hi = lo.view(-1, 1, 1, 1), hi.view(-1, 1, 1, 1)
+        return ((images - lo) / (hi - lo + 1e-6)).clamp_(0.0, 1.0)
+
+    def median_blur(self, images):
+        # Same uint8 quantisation and replicated border as cv2.medianBlur(u8, 3)
+        u8 = (images * 255).to(torch.uint8).float()
+        patches = F.pad(u8, (1, 1, 1, 1), mode="replicate").unfold(2, 3, 1)
+        patches = patches.unfold(3, 3, 1).flatten(-2)  # (N, C, H, W, 9)
+        return patches.median(dim=-1).values / 255.0
+
+    def forward(self, images, masks=None, resized=False):
+        if resized:
+            images = images.float().div_(255.0)
+        else:
+            images, masks = self.resize(images, masks)
+        images = self.contrast_stretch(images)
+        images = self.median_blur(images)
+        if masks is None:
+            return images
+        return images, masks
 
 
 class TrainTransforms:
     """
     Training transforms with spatial augmentation applied to both image and mask.
+
+    With gpu_intensity=True only the resize and the spatial augmentation run here
+    (in the DataLoader workers) and the image is returned as uint8; the contrast
+    stretch, median blur and color jitter then run batched on the GPU via
+    GPUPreprocessor(..., resized=True) and color_jitter_batch.
+    With gpu_spatial=True as well, the workers only resize and the flips and
+    rotation run batched on the GPU too, via spatial_batch (before GPUPreprocessor).
     """
 
     def __init__(
@@ -48,12 +200,54 @@ class TrainTransforms:
         rotation_degrees=15,
         p_rotate=0.5,
         p_color_jitter=0.3,
+        gpu_intensity=False,
+        gpu_spatial=False,
     ):
         self.p_hflip = p_hflip
         self.p_vflip = p_vflip
         self.rotation_degrees = rotation_degrees
         self.p_rotate = p_rotate
         self.p_color_jitter = p_color_jitter
+        self.gpu_intensity = gpu_intensity
+        self.gpu_spatial = gpu_spatial and gpu_intensity
+
+    def color_jitter_batch(self, images):
+        """Batched color jitter for float (N, C, H, W) images in [0, 1], on any device."""
+        n = images.shape[0]
+        jitter = torch.rand(n, device=images.device) < self.p_color_jitter
+        factors = torch.empty(n, device=images.device).uniform_(0.8, 1.2)
+        factors = torch.where(jitter, factors, torch.ones_like(factors))
+        return (images * factors.view(-1, 1, 1, 1)).clamp_(0.0, 1.0)
+
+    def spatial_batch(self, images, masks):
+        """
+        Batched flips + rotation for (N, C, H, W) uint8 images and (N, 1, H, W) masks,
+        on any device, drawn per sample with the same probabilities as __call__.
+
+        Flips and rotation are folded into one affine grid per sample, so the batch is
+        resampled once (bilinear for images, nearest for masks, black fill). Images
+        come back as float rounded to whole [0, 255] levels, ready for
+        GPUPreprocessor(..., resized=True).
+        """
+        n, device = images.shape[0], images.device
+        sx = torch.where(torch.rand(n, device=device) < self.p_hflip, -1.0, 1.0)
+        sy = torch.where(torch.rand(n, device=device) < self.p_vflip, -1.0, 1.0)
+        rotate = torch.rand(n, device=device) < self.p_rotate
+        angle = torch.empty(n, device=device).uniform_(
+            -self.rotation_degrees, self.rotation_degrees
+        )
+        angle = torch.where(rotate, angle.deg2rad_(), torch.zeros_like(angle))
+        cos, sin = angle.cos(), angle.sin()
+        # Output -> input sampling: undo the counter-clockwise rotation, then the flips
+        theta = torch.zeros(n, 2, 3, device=device)
+        theta[:, 0, 0], theta[:, 0, 1] = sx * cos, -sx * sin
+        theta[:, 1, 0], theta[:, 1, 1] = sy * sin, sy * cos
+        grid = F.affine_grid(theta, list(images.shape), align_corners=False)
+        images = F.grid_sample(
+            images.float(), grid, mode="bilinear", align_corners=False
+        ).round_()
+        masks = F.grid_sample(masks.float(), grid, mode="nearest", align_corners=False)
+        return images, masks
 
     def __call__(self, image, mask):
         """
@@ -62,54 +256,60 @@ class TrainTransforms:
             image: numpy array (H, W, C) uint8
             mask: numpy array (H, W) uint8 with values 0/1
         Returns:
-            image: torch tensor (C, H, W) float32
+            image: torch tensor (C, H, W) float32 (uint8 with gpu_intensity)
             mask: torch tensor (1, H, W) float32
         """
-        # Convert to PIL for torchvision transforms
-        from PIL import Image
-
-        image_pil = Image.fromarray(image)
-        mask_pil = Image.fromarray((mask * 255).astype(np.uint8))
-
-        # Resize
-        image_pil = TF.resize(image_pil, [512, 512])
-        mask_pil = TF.resize(
-            mask_pil, [512, 512], interpolation=TF.InterpolationMode.NEAREST
-        )
+        image = np.ascontiguousarray(image)
 
-        # Random horizontal flip
-        if random.random() < self.p_hflip:
-            image_pil = TF.hflip(image_pil)
-            mask_pil = TF.hflip(mask_pil)
+        # Resize (skipped for samples already at 512x512, e.g. from the cache)
+        if image.shape[:2] != (512, 512):
+            # Stays on PIL: its antialiased bilinear is what valTransforms,
+            # build_cache.py and GPUPreprocessor reproduce
+            image = np.array(TF.resize(Image.fromarray(image), [512, 512]))
+            mask = cv2.resize(mask, (512, 512), interpolation=TRAIN_MASK_INTERPOLATION)
 
-        # Random vertical flip
-        if random.random() < self.p_vflip:
-            image_pil = TF.vflip(image_pil)
-            mask_pil = TF.vflip(mask_pil)
+        if self.gpu_spatial:
+            mask_tensor = torch.from_numpy(mask.astype(np.float32))[None, ...]
+            return torch.from_numpy(image).permute(2, 0, 1), mask_tensor
 
-        # Random rotation
+        # Random flips and rotation, drawn in this order
+        hflip = random.random() < self.p_hflip
+        vflip = random.random() < self.p_vflip
+        angle = None
         if random.random() < self.p_rotate:
             angle = random.uniform(-self.rotation_degrees, self.rotation_degrees)
-            image_pil = TF.rotate(
-                image_pil, angle, interpolation=TF.InterpolationMode.BILINEAR
-            )
-            mask_pil = TF.rotate(
-                mask_pil, angle, interpolation=TF.InterpolationMode.NEAREST
-            )
 
-        # Convert image to numpy for preprocessing
-        image_np = np.array(image_pil).astype(np.float32) / 255.0
-        image_np = contrast_stretch(image_np)
-        image_np = median_blur(image_np)
+        if angle is not None:
+            # One warp for flips + rotation (counter-clockwise about the centre, black
+            # fill, like TF.rotate): the flips are folded into the affine matrix
+            h, w = mask.shape
+            cx, cy = (w - 1) / 2, (h - 1) / 2
+            sx, sy = (-1.0 if hflip else 1.0), (-1.0 if vflip else 1.0)
+            rotation = cv2.getRotationMatrix2D((cx, cy), angle, 1.0)
+            flip = np.array([[sx, 0.0, (1 - sx) * cx], [0.0, sy, (1 - sy) * cy]])
+            affine = rotation[:, :2] @ flip
+            affine[:, 2] += rotation[:, 2]
+            image = cv2.warpAffine(image, affine, (w, h), flags=cv2.INTER_LINEAR)
+            mask = cv2.warpAffine(mask, affine, (w, h), flags=cv2.INTER_NEAREST)
+        elif hflip or vflip:
+            # cv2.flip codes: 1 horizontal, 0 vertical, -1 both in a single pass
+            code = -1 if hflip and vflip else int(hflip)
+            image = cv2.flip(image, code)
+            mask = cv2.flip(mask, code)
+
+        # Mask stays uint8 0/1 through the spatial ops
+        mask_tensor = torch.from_numpy(mask.astype(np.float32))[None, ...]
 
-        # Color jitter (only for image)
+        if self.gpu_intensity:
+            image_tensor = torch.from_numpy(image).permute(2, 0, 1)
+            return image_tensor, mask_tensor
+
+        # Color jitter (only for image), folded into the intensity lookup table
+        brightness_factor = None
         if random.random() < self.p_color_jitter:
             brightness_factor = random.uniform(0.8, 1.2)
-            image_np = np.clip(image_np * brightness_factor, 0.0, 1.0)
-
-        # Convert to torch tensors
-        image_tensor = torch.from_numpy(image_np).permute(2, 0, 1)  # HWC -> CHW
-        mask_np = (np.array(mask_pil) >= 127).astype(np.float32)
-        mask_tensor = torch.from_numpy(mask_np)[None, ...]  # Add channel dimension
+        image_tensor = torch.from_numpy(
+            stretch_and_blur(image, brightness_factor, chw=True)
+        )
 
         return image_tensor, mask_tensor
@@ -51,13 +51,15 @@ def training_data_dir(temp_dir, sample_image, sample_mask):
     images_dir.mkdir()
     masks_dir.mkdir()
 
-    # Create 3 image/mask pairs
-    for i in range(1, 4):
-        img_path = images_dir / f"image{i:03d}.jpg"
-        mask_path = masks_dir / f"image{i:03d}.png"
+    # Create 3 image/mask pairs (encoded once, the same bytes written for each)
+    import io
 
-        sample_image.save(img_path)
-        sample_mask.save(mask_path)
+    image_buffer, mask_buffer = io.BytesIO(), io.BytesIO()
+    sample_image.save(image_buffer, format="JPEG")
+    sample_mask.save(mask_buffer, format="PNG")
+    for i in range(1, 4):
+        (images_dir / f"image{i:03d}.jpg").write_bytes(image_buffer.getvalue())
+        (masks_dir / f"image{i:03d}.png").write_bytes(mask_buffer.getvalue())
 
     return temp_dir
 
@@ -1,5 +1,6 @@
 """Unit tests for data quality assurance."""
 
+import io
 import pytest
 import sys
 from pathlib import Path
@@ -20,6 +21,92 @@ spec.loader.exec_module(data_qa_module)
 validate_data = data_qa_module.validate_data
 
 
+# =============================================================================
+# Edge-case datasets
+# =============================================================================
+
+
+def _encode(image, format):
+    """Encode a PIL image (or uint8 grayscale array) once, for write_bytes reuse."""
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image, mode="L")
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def _write_pair(images_dir, masks_dir, name, image, mask, image_ext=".jpg"):
+    """Write encoded image/mask bytes (either may be None) under the given stem."""
+    if image is not None:
+        (images_dir / f"{name}{image_ext}").write_bytes(image)
+    if mask is not None:
+        (masks_dir / f"{name}.png").write_bytes(mask)
+
+
+@pytest.fixture(scope="session")
+def qa_datasets(tmp_path_factory):
+    """
+    Every edge-case dataset, materialized once per session.
+
+    validate_data only reads the directories, so the tests can share them instead of
+    re-encoding the same 512x512 images in a fresh temp dir each. Each distinct file
+    is encoded once and written with write_bytes wherever it is reused.
+    """
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(
+        rng.integers(0, 255, (512, 512, 3), dtype=np.uint8), mode="RGB"
+    )
+    image_png = _encode(image, "PNG")
+    image = _encode(image, "JPEG")
+    binary_mask = _encode((rng.random((512, 512)) < 0.3).astype(np.uint8) * 255, "PNG")
+    empty_mask = np.zeros((512, 512), dtype=np.uint8)
+    near_empty_mask = empty_mask.copy()
+    near_empty_mask[0:2, 0:2] = 255  # Only 4 pixels
+    near_empty_mask = _encode(near_empty_mask, "PNG")
+    empty_mask = _encode(empty_mask, "PNG")
+
+    datasets = {}
+
+    def dataset(name, images=True, masks=True):
+        root = tmp_path_factory.mktemp(name)
+        images_dir, masks_dir = root / "images", root / "masks"
+        if images:
+            images_dir.mkdir()
+        if masks:
+            masks_dir.mkdir()
+        datasets[name] = root
+        return images_dir, masks_dir
+
+    dataset("missing_images", images=False)
+    dataset("missing_masks", masks=False)
+    dataset("empty_directories")
+
+    _write_pair(*dataset("orphan_image"), "orphan", image, None)
+    _write_pair(*dataset("orphan_mask"), "orphan", None, binary_mask)
+    _write_pair(*dataset("empty_mask"), "test", image, empty_mask)
+    _write_pair(*dataset("near_empty_mask"), "test", image, near_empty_mask)
+
+    images_dir, masks_dir = dataset("corrupted_image")
+    (images_dir / "corrupted.jpg").write_bytes(b"not a real image")
+    _write_pair(images_dir, masks_dir, "corrupted", None, empty_mask)
+
+    images_dir, masks_dir = dataset("jpg_and_png")
+    _write_pair(images_dir, masks_dir, "test1", image, binary_mask)
+    _write_pair(
+        images_dir, masks_dir, "test2", image_png, binary_mask, image_ext=".png"
+    )
+
+    # Masks with different coverage levels (random foreground positions, one pass)
+    images_dir, masks_dir = dataset("coverage")
+    for i, coverage_pct in enumerate([10, 30, 50], start=1):
+        mask = np.zeros((512, 512), dtype=np.uint8)
+        num_pixels = int(512 * 512 * coverage_pct / 100)
+        mask.reshape(-1)[rng.choice(mask.size, num_pixels, replace=False)] = 255
+        _write_pair(images_dir, masks_dir, f"test{i}", image, _encode(mask, "PNG"))
+
+    return datasets
+
+
 # =============================================================================
 # Valid Data Tests
 # =============================================================================
@@ -51,62 +138,40 @@ def test_valid_data_statistics(training_data_dir):
 # =============================================================================
 
 
-def test_missing_images_directory(temp_dir):
-    """Test validation with missing images directory."""
-    masks_dir = temp_dir / "masks"
-    masks_dir.mkdir()
-
-    report = validate_data(temp_dir)
+@pytest.mark.parametrize(
+    "scenario, expected_error",
+    [
+        ("missing_images", "Images directory not found"),
+        ("missing_masks", "Masks directory not found"),
+        ("orphan_image", "Missing masks"),
+        ("orphan_mask", "Missing images"),
+        ("empty_mask", "Empty mask"),
+        ("near_empty_mask", "Near-empty mask"),
+    ],
+)
+def test_invalid_data_reports_error(qa_datasets, scenario, expected_error):
+    """Test that each kind of invalid dataset fails with its specific error."""
+    report = validate_data(qa_datasets[scenario])
 
     assert report["status"] == "FAIL"
-    assert any("Images directory not found" in err for err in report["errors"])
-
+    assert any(expected_error in err for err in report["errors"])
 
-def test_missing_masks_directory(temp_dir):
-    """Test validation with missing masks directory."""
-    images_dir = temp_dir / "images"
-    images_dir.mkdir()
 
-    report = validate_data(temp_dir)
+@pytest.mark.parametrize(
+    "scenario, image_count, mask_count",
+    [
+        ("orphan_image", 1, 0),
+        ("orphan_mask", 0, 1),
+        ("empty_directories", 0, 0),
+    ],
+)
+def test_unpaired_data_counts(qa_datasets, scenario, image_count, mask_count):
+    """Test that unpaired or missing files fail and are still counted."""
+    report = validate_data(qa_datasets[scenario])
 
     assert report["status"] == "FAIL"
-    assert any("Masks directory not found" in err for err in report["errors"])
-
-
-def test_missing_mask_for_image(temp_dir, sample_image):
-    """Test validation when image has no corresponding mask."""
-    images_dir = temp_dir / "images"
-    masks_dir = temp_dir / "masks"
-    images_dir.mkdir()
-    masks_dir.mkdir()
-
-    # Create image without mask
-    sample_image.save(images_dir / "orphan.jpg")
-
-    report = validate_data(temp_dir)
-
-    assert report["status"] == "FAIL"
-    assert report["image_count"] == 1
-    assert report["mask_count"] == 0
-    assert any("Missing masks" in err for err in report["errors"])
-
-
-def test_missing_image_for_mask(temp_dir, sample_mask):
-    """Test validation when mask has no corresponding image."""
-    images_dir = temp_dir / "images"
-    masks_dir = temp_dir / "masks"
-    images_dir.mkdir()
-    masks_dir.mkdir()
-
-    # Create mask without image
-    sample_mask.save(masks_dir / "orphan.png")
-
-    report = validate_data(temp_dir)
-
-    assert report["status"] == "FAIL"
-    assert report["image_count"] == 0
-    assert report["mask_count"] == 1
-    assert any("Missing images" in err for err in report["errors"])
+    assert report["image_count"] == image_count
+    assert report["mask_count"] == mask_count
 
 
 # TEMPORARILY DISABLED
@@ -150,61 +215,9 @@ def test_missing_image_for_mask(temp_dir, sample_mask):
 #     assert any("Non-binary mask" in err for err in report["errors"])
 
 
-def test_empty_mask(temp_dir, sample_image):
-    """Test validation with empty mask (all zeros)."""
-    images_dir = temp_dir / "images"
-    masks_dir = temp_dir / "masks"
-    images_dir.mkdir()
-    masks_dir.mkdir()
-
-    # Create valid image
-    sample_image.save(images_dir / "test.jpg")
-
-    # Create empty mask
-    empty_mask = np.zeros((512, 512), dtype=np.uint8)
-    Image.fromarray(empty_mask, mode="L").save(masks_dir / "test.png")
-
-    report = validate_data(temp_dir)
-
-    assert report["status"] == "FAIL"
-    assert any("Empty mask" in err for err in report["errors"])
-
-
-def test_near_empty_mask(temp_dir, sample_image):
-    """Test validation with near-empty mask (very few pixels)."""
-    images_dir = temp_dir / "images"
-    masks_dir = temp_dir / "masks"
-    images_dir.mkdir()
-    masks_dir.mkdir()
-
-    # Create valid image
-    sample_image.save(images_dir / "test.jpg")
-
-    # Create mask with very few foreground pixels
-    mask = np.zeros((512, 512), dtype=np.uint8)
-    mask[0:2, 0:2] = 255  # Only 4 pixels
-    Image.fromarray(mask, mode="L").save(masks_dir / "test.png")
-
-    report = validate_data(temp_dir)
-
-    assert report["status"] == "FAIL"
-    assert any("Near-empty mask" in err for err in report["errors"])
-
-
-def test_corrupted_image_file(temp_dir):
+def test_corrupted_image_file(qa_datasets):
     """Test validation with corrupted image file."""
-    images_dir = temp_dir / "images"
-    masks_dir = temp_dir / "masks"
-    images_dir.mkdir()
-    masks_dir.mkdir()
-
-    # Create corrupted file
-    (images_dir / "corrupted.jpg").write_bytes(b"not a real image")
-    # Create valid mask
-    mask = np.zeros((512, 512), dtype=np.uint8)
-    Image.fromarray(mask, mode="L").save(masks_dir / "corrupted.png")
-
-    report = validate_data(temp_dir)
+    report = validate_data(qa_datasets["corrupted_image"])
 
     assert report["status"] == "FAIL"
     # Should have an error about the corrupted file
@@ -215,20 +228,6 @@ def test_corrupted_image_file(temp_dir):
 # =============================================================================
 
 
-def test_empty_directories(temp_dir):
-    """Test validation with empty directories."""
-    images_dir = temp_dir / "images"
-    masks_dir = temp_dir / "masks"
-    images_dir.mkdir()
-    masks_dir.mkdir()
-
-    report = validate_data(temp_dir)
-
-    assert report["status"] == "FAIL"
-    assert report["image_count"] == 0
-    assert report["mask_count"] == 0
-
-
 # TEMPORARYLY DISABLED
 # def test_mixed_valid_and_invalid_data(temp_dir, sample_image, sample_mask):
 #     """Test validation with mix of valid and invalid data."""
@@ -255,22 +254,9 @@ def test_empty_directories(temp_dir):
 #     assert len(report["errors"]) > 0
 
 
-def test_jpg_and_png_images(temp_dir, sample_image, sample_mask):
+def test_jpg_and_png_images(qa_datasets):
     """Test that both JPG and PNG images are detected."""
-    images_dir = temp_dir / "images"
-    masks_dir = temp_dir / "masks"
-    images_dir.mkdir()
-    masks_dir.mkdir()
-
-    # Save as JPG
-    sample_image.save(images_dir / "test1.jpg")
-    sample_mask.save(masks_dir / "test1.png")
-
-    # Save as PNG
-    sample_image.save(images_dir / "test2.png")
-    sample_mask.save(masks_dir / "test2.png")
-
-    report = validate_data(temp_dir)
+    report = validate_data(qa_datasets["jpg_and_png"])
 
     assert report["status"] == "PASS"
     assert report["image_count"] == 2
@@ -282,26 +268,9 @@ def test_jpg_and_png_images(temp_dir, sample_image, sample_mask):
 # =============================================================================
 
 
-def test_coverage_statistics(temp_dir, sample_image):
+def test_coverage_statistics(qa_datasets):
     """Test that coverage statistics are computed correctly."""
-    images_dir = temp_dir / "images"
-    masks_dir = temp_dir / "masks"
-    images_dir.mkdir()
-    masks_dir.mkdir()
-
-    # Create masks with different coverage levels
-    for i, coverage_pct in enumerate([10, 30, 50], start=1):
-        sample_image.save(images_dir / f"test{i}.jpg")
-
-        # Create mask with specific coverage
-        mask = np.zeros((512, 512), dtype=np.uint8)
-        num_pixels = int(512 * 512 * coverage_pct / 100)
-        mask.flat[:num_pixels] = 255
-        np.random.shuffle(mask.flat)
-
-        Image.fromarray(mask, mode="L").save(masks_dir / f"test{i}.png")
-
-    report = validate_data(temp_dir)
+    report = validate_data(qa_datasets["coverage"])
 
     assert report["status"] == "PASS"
     assert "median_coverage_%" in report["statistics"]
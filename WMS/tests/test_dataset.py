@@ -0,0 +1,97 @@
+"""Unit tests for the training dataset loading."""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader
+from torchvision.io import ImageReadMode, decode_image, read_file
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from build_cache import build_cache, ensure_cache  # noqa: E402
+from dataset import GPUDecodeLoader, WMSDataset, raw_collate  # noqa: E402
+from transforms import TrainTransforms  # noqa: E402
+
+
+@pytest.fixture
+def rotated_sample(temp_dir, sample_mask):
+    """A JPEG stored sideways with EXIF Orientation=6 (as phones save it) and its mask."""
+    image_array = np.random.randint(0, 255, (100, 200, 3), dtype=np.uint8)
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    image_path = temp_dir / "rotated.jpg"
+    Image.fromarray(image_array).save(image_path, exif=exif)
+    mask_path = temp_dir / "rotated.png"
+    sample_mask.save(mask_path)
+    return image_path, mask_path
+
+
+def test_load_applies_exif_orientation(rotated_sample):
+    """The decoded image is rotated upright (90 degrees clockwise) like cv2.imread did."""
+    image_path, mask_path = rotated_sample
+    dataset = WMSDataset([str(image_path)], [str(mask_path)])
+
+    image, _ = dataset.load(0)
+
+    stored = decode_image(read_file(str(image_path)), mode=ImageReadMode.RGB)
+    assert image.shape == (3, 200, 100)
+    np.testing.assert_array_equal(image.numpy(), np.rot90(stored.numpy(), k=-1, axes=(1, 2)))
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_gpu_decode_loader_matches_cpu_orientation(temp_dir, sample_mask, orientation):
+    """GPUDecodeLoader (nvJPEG ignores EXIF) orients images like the CPU decode."""
+    image_array = np.random.randint(0, 255, (100, 200, 3), dtype=np.uint8)
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    image_path = temp_dir / "oriented.jpg"
+    Image.fromarray(image_array).save(image_path, exif=exif)
+    mask_path = temp_dir / "oriented.png"
+    sample_mask.save(mask_path)
+    paths = [str(image_path)], [str(mask_path)]
+    encoded = WMSDataset(*paths, raw=True, encoded=True)
+    loader = DataLoader(encoded, batch_size=1, collate_fn=raw_collate)
+
+    (image,), _ = next(iter(GPUDecodeLoader(loader, torch.device("cpu"))))
+
+    expected, _ = WMSDataset(*paths).load(0)
+    torch.testing.assert_close(image, expected, rtol=0, atol=0)
+
+
+def test_train_cache_masks_match_train_transforms(temp_dir):
+    """Enabling data.cache does not change the resized training masks."""
+    image_path, mask_path = temp_dir / "sample.jpg", temp_dir / "sample.png"
+    Image.fromarray(np.zeros((300, 700, 3), dtype=np.uint8)).save(image_path)
+    mask = (np.random.rand(300, 700) < 0.3).astype(np.uint8) * 255
+    Image.fromarray(mask).save(mask_path)
+    paths = [str(image_path)], [str(mask_path)]
+    build_cache(*paths, str(temp_dir / "cache"), train=True)
+    no_augmentation = TrainTransforms(0, 0, p_rotate=0, p_color_jitter=0)
+
+    _, expected = WMSDataset(*paths, paired_transforms=no_augmentation)[0]
+    _, cached = WMSDataset(
+        *paths, paired_transforms=no_augmentation, cache_dir=str(temp_dir / "cache")
+    )[0]
+
+    torch.testing.assert_close(cached, expected, rtol=0, atol=0)
+
+
+def test_ensure_cache_rebuilds_unknown_data_version(temp_dir, sample_image, sample_mask):
+    """Without a dvc.lock version the cache can't be trusted and is rebuilt."""
+    image_path, mask_path = temp_dir / "sample.png", temp_dir / "sample.png.mask.png"
+    sample_image.save(image_path)
+    sample_mask.save(mask_path)
+    paths = [str(image_path)], [str(mask_path)]
+    cache_dir = str(temp_dir / "cache")
+    ensure_cache(*paths, cache_dir, version="unknown")
+    Image.new("RGB", sample_image.size).save(image_path)  # same name, new pixels
+
+    ensure_cache(*paths, cache_dir, version="unknown")
+
+    image, _ = WMSDataset(*paths, cache_dir=cache_dir).load(0)
+    assert not image.any()
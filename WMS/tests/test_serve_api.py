@@ -36,6 +36,7 @@ def client():
     app_module.model = MockModel()
     app_module.device = torch.device("cpu")
     app_module.model_loaded.set(1)
+    app_module.mask_cache.clear()
 
     return TestClient(app)
 
@@ -62,6 +63,18 @@ def test_preprocess_image_different_size():
     assert tensor.shape == (1, 3, 512, 512)
 
 
+def test_preprocess_image_matches_val_transforms():
+    """Serving preprocessing matches valTransforms used during training."""
+    from WMS.src.transforms import valTransforms
+
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (300, 400, 3), dtype=np.uint8))
+    tensor = preprocess_image(image)
+
+    expected = valTransforms(np.array(image)).unsqueeze(0)
+    assert torch.equal(tensor, expected)
+
+
 # =============================================================================
 # Postprocessing Tests
 # =============================================================================
@@ -80,6 +93,17 @@ def test_postprocess_mask():
     assert set(np.unique(mask)).issubset({0, 255})  # Binary mask
 
 
+def test_postprocess_mask_matches_sigmoid_threshold():
+    """Thresholding logits at 0 gives the same mask as sigmoid > 0.5."""
+    output = torch.randn(1, 1, 512, 512)
+    output[0, 0, 0, :3] = torch.tensor([0.0, 1e-6, -1e-6])
+
+    mask = postprocess_mask(output)
+
+    expected = (torch.sigmoid(output) > 0.5).squeeze().numpy().astype(np.uint8) * 255
+    np.testing.assert_array_equal(mask, expected)
+
+
 def test_mask_to_base64():
     """Test mask to base64 encoding."""
     mask = np.random.choice([0, 255], size=(512, 512)).astype(np.uint8)
@@ -95,6 +119,9 @@ def test_mask_to_base64():
     decoded_bytes = base64.b64decode(base64_str)
     decoded_image = Image.open(io.BytesIO(decoded_bytes))
     assert decoded_image.size == (512, 512)
+    # 8-bit grayscale PNG decodes to the original 0/255 mask as-is
+    assert decoded_image.mode == "L"
+    np.testing.assert_array_equal(np.array(decoded_image), mask)
 
 
 # =============================================================================
@@ -152,6 +179,38 @@ def test_predict_endpoint(client, sample_image_bytes):
     assert "latency_seconds" in data["metadata"]
 
 
+def test_predict_raw_endpoint(client, sample_image_bytes):
+    """Test raw PNG prediction endpoint."""
+    files = {"image": ("test.jpg", sample_image_bytes, "image/jpeg")}
+    response = client.post("/predict_raw", files=files)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert "x-latency" in response.headers
+    assert response.headers["x-input-size"] == "512x512"
+
+    mask_image = Image.open(io.BytesIO(response.content))
+    assert mask_image.size == (512, 512)
+
+
+def test_predict_endpoint_cache_hit(client, sample_image_bytes):
+    """Re-uploading the same image is answered from the cache."""
+    from WMS.src.serve import app as app_module
+
+    class FailingModel(torch.nn.Module):
+        def forward(self, x):
+            raise AssertionError("cache miss")
+
+    files = {"image": ("test.png", sample_image_bytes, "image/png")}
+    first = client.post("/predict_raw", files=files)
+
+    app_module.model = FailingModel()
+    second = client.post("/predict_raw", files=files)
+
+    assert first.status_code == second.status_code == 200
+    assert first.content == second.content
+
+
 def test_predict_endpoint_png(client, sample_image):
     """Test prediction with PNG image."""
     buffer = io.BytesIO()
@@ -220,6 +279,46 @@ def test_metrics_endpoint(client):
     assert "wms_model_loaded" in content
 
 
+# =============================================================================
+# Batching Tests
+# =============================================================================
+
+
+def test_dynamic_batcher_coalesces_requests():
+    """Concurrent requests are served by a single batched forward pass."""
+    import asyncio
+    from WMS.src.serve import app as app_module
+
+    calls = []
+
+    class RecordingModel(torch.nn.Module):
+        def forward(self, x):
+            calls.append(x.shape[0])
+            return x[:, :1] * 2
+
+    original_model, original_device = app_module.model, app_module.device
+    app_module.model = RecordingModel()
+    app_module.device = torch.device("cpu")
+
+    async def run():
+        batcher = app_module.DynamicBatcher(max_batch_size=8, max_delay=0.05)
+        batcher.start()
+        inputs = [torch.full((1, 3, 8, 8), float(i)) for i in range(3)]
+        outputs = await asyncio.gather(*(batcher.submit(t) for t in inputs))
+        await batcher.stop()
+        return inputs, outputs
+
+    try:
+        inputs, outputs = asyncio.run(run())
+    finally:
+        app_module.model, app_module.device = original_model, original_device
+
+    assert calls == [3]
+    for tensor, output in zip(inputs, outputs):
+        assert output.shape == (1, 1, 8, 8)
+        assert torch.equal(output, tensor[:, :1] * 2)
+
+
 # =============================================================================
 # Integration Tests
 # =============================================================================
@@ -0,0 +1,78 @@
+"""Unit tests for the fused preprocessing against the step-by-step reference chain."""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from transforms import (  # noqa: E402
+    contrast_stretch,
+    median_blur,
+    stretch_and_blur_u8,
+    to_chw_tensor,
+    to_float_np,
+    u8_percentiles,
+    valTransforms,
+)
+
+
+def reference_val_transforms(img):
+    """The former valTransforms: PIL resize -> to_float_np -> contrast_stretch -> median_blur."""
+    img = np.asarray(Image.fromarray(img).resize((512, 512), Image.BILINEAR))
+    return to_chw_tensor(median_blur(contrast_stretch(to_float_np(img))))
+
+
+def _images():
+    rng = np.random.default_rng(0)
+    return {
+        "random_512": rng.integers(0, 256, (512, 512, 3), dtype=np.uint8),
+        "low_contrast_512": rng.integers(100, 108, (512, 512, 3), dtype=np.uint8),
+        "gradient_512": np.broadcast_to(
+            np.linspace(0, 255, 512, dtype=np.uint8)[None, :, None], (512, 512, 3)
+        ).copy(),
+        "constant_512": np.full((512, 512, 3), 77, dtype=np.uint8),
+        "random_300x400": rng.integers(0, 256, (300, 400, 3), dtype=np.uint8),
+        "low_contrast_300x400": rng.integers(30, 34, (300, 400, 3), dtype=np.uint8),
+    }
+
+
+IMAGES = _images()
+
+
+@pytest.mark.parametrize("name", IMAGES)
+def test_u8_percentiles_match_numpy(name):
+    """The histogram percentiles equal np.percentile of the float image, bit for bit."""
+    img = IMAGES[name]
+
+    expected = np.percentile(to_float_np(img), (2, 98))
+
+    np.testing.assert_array_equal(u8_percentiles(img), expected)
+
+
+@pytest.mark.parametrize("name", IMAGES)
+def test_val_transforms_match_reference_chain(name):
+    """valTransforms gives exactly the output of the step-by-step chain."""
+    img = IMAGES[name]
+
+    output = valTransforms(img)
+
+    assert output.dtype == torch.float32
+    assert output.shape == (3, 512, 512)
+    assert output.is_contiguous()
+    torch.testing.assert_close(output, reference_val_transforms(img), rtol=0, atol=0)
+
+
+@pytest.mark.parametrize("name", [n for n in IMAGES if n.endswith("_512")])
+def test_stretch_and_blur_u8_matches_reference_chain(name):
+    """The cached uint8 levels are the reference output times 255."""
+    img = IMAGES[name]
+
+    expected = median_blur(contrast_stretch(to_float_np(img))) * 255
+
+    np.testing.assert_array_equal(stretch_and_blur_u8(img), np.rint(expected))
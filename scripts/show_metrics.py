@@ -60,7 +60,9 @@ def show_production_metrics():
                     print(f"    {param}: {run.data.params[param]}")
 
         # Quality assessment
-        dice = run.data.metrics.get('val_dice', run.data.metrics.get('test_dice', 0))
+        # Same preference as the training workflow: test metrics of best.pth first
+        metrics = run.data.metrics
+        dice = metrics.get('final_test_dice', metrics.get('test_dice', metrics.get('val_dice', 0)))
         print(f"\n{'='*60}")
         if dice >= 0.85:
             print("✅ EXCELLENT MODEL (Dice >= 85%)")
@@ -99,8 +101,9 @@ def show_all_versions():
 
         for v in sorted(versions, key=lambda x: int(x.version), reverse=True):
             run = client.get_run(v.run_id)
-            dice = run.data.metrics.get('val_dice', run.data.metrics.get('test_dice', 0))
-            iou = run.data.metrics.get('val_iou', run.data.metrics.get('test_iou', 0))
+            metrics = run.data.metrics
+            dice = metrics.get('final_test_dice', metrics.get('test_dice', metrics.get('val_dice', 0)))
+            iou = metrics.get('final_test_iou', metrics.get('test_iou', metrics.get('val_iou', 0)))
 
             stage_marker = "🏆 PRODUCTION" if v.current_stage == "Production" else v.current_stage
             print(f"Version {v.version}: {stage_marker}")